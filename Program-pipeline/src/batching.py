@@ -0,0 +1,124 @@
+# src/batching.py
+"""
+按长度分桶的动态补齐
+- 数据集只保存未补齐的 token 序列（预分词缓存的 memmap 切片）
+- BucketBatchSampler 把长度相近的样本放进同一批，桶内与批次顺序仍然随机
+- PadCollate 只把每批补齐到本批最长的长度，而不是全量语料的最长长度
+"""
+from typing import Iterator, List
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+from token_cache import TokenCache
+
+
+class TokenizedDataset(Dataset):
+    def __init__(self, cache: TokenCache, rows: np.ndarray, labels: np.ndarray):
+        self.cache = cache
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        return self.cache.sequence(self.rows[idx]), self.labels[idx]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.cache.lengths(self.rows)
+
+    def subset(self, indices) -> "TokenizedDataset":
+        return TokenizedDataset(self.cache, self.rows[indices], self.labels[indices])
+
+
+class PadCollate:
+    """返回 (input_ids, attention_mask, labels)，与原 TensorDataset 的批结构一致"""
+
+    def __init__(self, pad_token_id: int = 0):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, batch):
+        width = max(len(seq) for seq, _ in batch)
+        input_ids = torch.full((len(batch), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), width), dtype=torch.long)
+        for i, (seq, _) in enumerate(batch):
+            input_ids[i, :len(seq)] = torch.from_numpy(np.asarray(seq, dtype=np.int64))
+            attention_mask[i, :len(seq)] = 1
+        labels = torch.tensor([label for _, label in batch], dtype=torch.long)
+        return input_ids, attention_mask, labels
+
+
+class BucketBatchSampler(Sampler[List[int]]):
+    """
+    shuffle=True：先全局打乱，每 batch_size * bucket_multiplier 个样本为一个桶，桶内按长度排序后切批，再打乱批次顺序
+    shuffle=False：全部按长度排序后切批（评估用，结果与顺序无关）
+    num_replicas > 1 时各进程用相同的种子切出同一份批次列表，再按 rank 轮流领取；
+    训练时批数补齐到进程数的整数倍，保证各进程步数一致（DDP 每步都要同步梯度），评估时不补齐以免重复计数
+    """
+
+    def __init__(self, lengths, batch_size: int, shuffle: bool = True, bucket_multiplier: int = 50,
+                 drop_last: bool = False, seed: int = 0, num_replicas: int = 1, rank: int = 0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_multiplier
+        self.drop_last = drop_last
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        """每个 epoch 换一种打乱方式（与 DistributedSampler 的用法一致）"""
+        self.epoch = epoch
+
+    def _batches(self) -> List[np.ndarray]:
+        batches = self._all_batches()
+        if self.num_replicas == 1:
+            return batches
+        if self.shuffle and batches:
+            batches += [batches[i % len(batches)] for i in range(-len(batches) % self.num_replicas)]
+        return batches[self.rank::self.num_replicas]
+
+    def _all_batches(self) -> List[np.ndarray]:
+        if not self.shuffle:
+            order = np.argsort(self.lengths, kind='stable')
+            return [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+        rng = np.random.default_rng(self.seed + self.epoch)
+        perm = rng.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(perm), self.bucket_size):
+            bucket = perm[start:start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        if self.drop_last:
+            batches = [b for b in batches if len(b) == self.batch_size]
+        return [batches[i] for i in rng.permutation(len(batches))]
+
+    def __iter__(self) -> Iterator[List[int]]:
+        for batch in self._batches():
+            yield batch.tolist()
+
+    def _num_all_batches(self) -> int:
+        n = len(self.lengths)
+        if not self.shuffle:
+            return -(-n // self.batch_size)
+        # 整桶各切 bucket_multiplier 批，最后一个不满的桶单独切
+        full, rest = divmod(n, self.bucket_size)
+        per_bucket = self.bucket_size // self.batch_size
+        if self.drop_last:
+            return full * per_bucket + rest // self.batch_size
+        return full * per_bucket + -(-rest // self.batch_size)
+
+    def __len__(self):
+        # 只做算术，不重新打乱切批（训练循环里可能频繁调用）
+        total = self._num_all_batches()
+        if self.num_replicas == 1:
+            return total
+        if self.shuffle and total:
+            total += -total % self.num_replicas
+        return len(range(self.rank, total, self.num_replicas))
@@ -0,0 +1,113 @@
+# src/checkpoint.py
+"""
+可恢复的训练检查点与早停
+- 每 N 个 epoch 原子写入 模型 + 优化器 + epoch + 早停状态 + 随机数状态
+- 重新启动时自动从最近的检查点继续；数据或超参变了的检查点不会被误用
+- 验证集损失连续 patience 个 epoch 没有改善就停止，并回退到最好的权重
+"""
+import copy
+import os
+import random
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+CHECKPOINT_DIR = "models/checkpoints"
+
+
+def rng_state() -> Dict:
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+
+
+def set_rng_state(state: Dict):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+
+
+class EarlyStopping:
+    def __init__(self, patience: int = 3, min_delta: float = 0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_loss = float("inf")
+        self.best_epoch = -1
+        self.best_state = None
+        self.bad_epochs = 0
+        self.stopped = False
+
+    def step(self, val_loss: float, model: torch.nn.Module, epoch: int) -> bool:
+        """记录本 epoch 的验证损失，返回是否应该停止"""
+        if val_loss < self.best_loss - self.min_delta:
+            self.best_loss = val_loss
+            self.best_epoch = epoch
+            self.best_state = copy.deepcopy({k: v.detach().cpu() for k, v in model.state_dict().items()})
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        self.stopped = self.patience > 0 and self.bad_epochs >= self.patience
+        return self.stopped
+
+    def restore_best(self, model: torch.nn.Module):
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+
+    def state_dict(self) -> Dict:
+        return {k: getattr(self, k) for k in ("best_loss", "best_epoch", "best_state", "bad_epochs", "stopped")}
+
+    def load_state_dict(self, state: Dict):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+
+class CheckpointManager:
+    def __init__(self, directory: str = CHECKPOINT_DIR, every: int = 1, run_key: str = ""):
+        self.path = os.path.join(directory, "last.pt")
+        self.every = max(1, every)
+        self.run_key = run_key  # 数据 + 超参的指纹，不一致的检查点不恢复
+
+    def save(self, epoch: int, model, optimizer, stopper: EarlyStopping, force: bool = False):
+        if not force and (epoch + 1) % self.every:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        torch.save({
+            "run_key": self.run_key,
+            "epoch": epoch,
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "early_stopping": stopper.state_dict(),
+            "rng": rng_state(),
+        }, tmp)
+        os.replace(tmp, self.path)  # 写到一半被杀不会破坏上一个检查点
+        print(f"💾 Checkpoint saved at epoch {epoch}")
+
+    def load(self) -> Optional[Dict]:
+        if not os.path.exists(self.path):
+            return None
+        ckpt = torch.load(self.path, map_location="cpu", weights_only=False)
+        if ckpt.get("run_key") != self.run_key:
+            print("⚠️ Checkpoint belongs to a different data/params version, starting fresh.")
+            return None
+        return ckpt
+
+    def resume(self, model, optimizer, stopper: EarlyStopping) -> int:
+        """从检查点恢复，返回下一个要训练的 epoch（无检查点时为 0）"""
+        ckpt = self.load()
+        if ckpt is None:
+            return 0
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        stopper.load_state_dict(ckpt["early_stopping"])
+        set_rng_state(ckpt["rng"])
+        print(f"⏩ Resuming from checkpoint after epoch {ckpt['epoch']}")
+        return ckpt["epoch"] + 1
+
+    def clear(self):
+        """整次训练结束后删除检查点，下次训练从头开始"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,9 +1,11 @@
 # src/data.py
+import hashlib
 import json
+import numpy as np
 import pandas as pd
-from transformers import AutoTokenizer
 from typing import Dict, Tuple
-import torch
+from token_cache import TokenCache, TOKEN_CACHE_DIR
+from batching import TokenizedDataset
 
 # 定义类别到索引的映射（必须固定！）
 LABEL2ID: Dict[str, int] = {
@@ -25,6 +27,7 @@ def load_data(json_path: str) -> pd.DataFrame:
     with open(json_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
 
+    keys = []
     texts = []
     labels = []
 
@@ -41,36 +44,76 @@ def load_data(json_path: str) -> pd.DataFrame:
             print(f"⚠️ Unknown category '{category}', mapped to '其他'")
             category = "其他"  # 默认类别
 
+        # 样本键：优先用 url，其次 Label Studio 任务 id，用于数据变更检测时逐条比对
+        keys.append(str(item.get("url") or item.get("id") or text))
         texts.append(text)
         labels.append(LABEL2ID[category])
 
     return pd.DataFrame({
+        'key': keys,
         'text': texts,
         'label': labels
     })
 
 
-def tokenize_data(df: pd.DataFrame, model_name: str, max_length: int) -> Tuple[Dict, torch.Tensor]:
+def tokenize_data(df: pd.DataFrame, model_name: str, max_length: int,
+                  cache_dir: str = TOKEN_CACHE_DIR) -> TokenizedDataset:
     """
     对文本进行分词处理
+    已分过词的文本直接从预分词缓存读取，只对新文本调用分词器
+    序列不在这里补齐，由 batching.PadCollate 按批补齐
     """
-    from transformers import AutoTokenizer
-    import torch
+    cache = TokenCache(model_name, max_length, cache_dir)
+    rows = cache.rows_for(df['text'].tolist())
+    return TokenizedDataset(cache, rows, df['label'].to_numpy())
 
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
 
-    # 编码文本
-    encodings = tokenizer(
-        df['text'].tolist(),
-        truncation=True,
-        padding=True,
-        max_length=max_length,
-        return_tensors="pt"
-    )
+SPLIT_BUCKETS = 10000  # 按样本键哈希分桶的精度
 
-    labels = torch.tensor(df['label'].tolist(), dtype=torch.long)
 
-    return encodings, labels
+def split_bucket(key: str) -> float:
+    """样本键 → [0, 1) 上的固定位置；与数据里其他样本无关，增删样本不会让已有样本换到别的集合"""
+    digest = hashlib.sha256(str(key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % SPLIT_BUCKETS / SPLIT_BUCKETS
+
+
+def stratified_split(keys, labels, val_ratio: float,
+                     test_ratio: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    按样本键的哈希划分 训练 / 验证 / 测试 下标：同一条样本永远落在同一个集合，
+    增量训练时旧模型见过的样本不会因为数据增删被换进验证 / 测试集
+    哈希位置 < test_ratio 进测试集，< test_ratio + val_ratio 进验证集，其余进训练集；各类别按同一规则划分，比例自然分层
+    某类全部落进验证 / 测试集时，把最靠近训练区间的一条留给训练集
+    """
+    labels = np.asarray(labels)
+    position = np.array([split_bucket(k) for k in keys])
+    train, val, test = [], [], []
+    for label in np.unique(labels):
+        idx = np.flatnonzero(labels == label)
+        pos = position[idx]
+        is_test = pos < test_ratio
+        is_val = ~is_test & (pos < test_ratio + val_ratio)
+        is_train = ~(is_test | is_val)
+        if not is_train.any():
+            keep = np.argmax(pos)
+            is_test[keep] = is_val[keep] = False
+            is_train[keep] = True
+        test.append(idx[is_test])
+        val.append(idx[is_val])
+        train.append(idx[is_train])
+    empty = np.empty(0, dtype=np.int64)
+    return tuple(np.sort(np.concatenate(part)) if part else empty for part in (train, val, test))
+
+
+def incremental_subset(keys, train_idx: np.ndarray, delta_keys: set, replay_ratio: float = 1.0,
+                       seed: int = 42) -> np.ndarray:
+    """增量微调的训练下标：训练集中新增 / 修改的样本，加上按比例随机回放的旧样本以缓解遗忘"""
+    keys = np.asarray(keys)
+    is_delta = np.isin(keys[train_idx], list(delta_keys))
+    fresh, old = train_idx[is_delta], train_idx[~is_delta]
+    n_replay = min(len(old), int(round(len(fresh) * replay_ratio)))
+    replay = np.random.default_rng(seed).choice(old, n_replay, replace=False)
+    return np.sort(np.concatenate([fresh, replay]))
 
 
 def get_num_labels() -> int:
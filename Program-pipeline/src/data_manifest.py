@@ -0,0 +1,114 @@
+# src/data_manifest.py
+"""
+数据变更检测（替代 shell 调用 dvc status + 字符串匹配）
+- 清单记录数据文件的 大小 / mtime / sha256，以及每条标注样本的内容摘要
+- 大小和 mtime 都没变时不读文件直接判定未变化；变了再算哈希，哈希相同只刷新 mtime
+- 文件内容确实变了才逐条比对，给出新增 / 删除 / 修改的样本，供训练选择全量重训或增量微调
+"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import pandas as pd
+
+MANIFEST_PATH = "data/manifest.json"
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def example_digests(df: pd.DataFrame) -> Dict[str, str]:
+    """样本键 → (文本, 标签) 摘要"""
+    return {
+        key: hashlib.sha1(f"{text}\0{label}".encode('utf-8')).hexdigest()
+        for key, text, label in zip(df['key'], df['text'], df['label'])
+    }
+
+
+@dataclass
+class DataDelta:
+    changed: bool
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    total: int = 0
+    first_run: bool = False
+    _pending: Dict = field(default=None, repr=False)  # 训练完成后才写入的新清单
+
+    @property
+    def delta_keys(self) -> set:
+        """需要重新学习的样本（新增 + 修改）"""
+        return set(self.added) | set(self.modified)
+
+    @property
+    def ratio(self) -> float:
+        return (len(self.added) + len(self.modified) + len(self.removed)) / max(self.total, 1)
+
+    def summary(self) -> str:
+        return f"+{len(self.added)} -{len(self.removed)} ~{len(self.modified)} / {self.total}"
+
+
+class DataManifest:
+    def __init__(self, data_path: str, manifest_path: str = MANIFEST_PATH):
+        self.data_path = data_path
+        self.manifest_path = manifest_path
+
+    def _load(self) -> Dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save(self, manifest: Dict):
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, self.manifest_path)
+
+    def detect(self, df_loader) -> DataDelta:
+        """df_loader(path) 返回带 key/text/label 列的 DataFrame，只在文件内容变化时才调用"""
+        manifest = self._load()
+        st = os.stat(self.data_path)
+        entry = manifest.get("file", {})
+        if entry.get("path") == self.data_path and entry.get("size") == st.st_size \
+                and entry.get("mtime_ns") == st.st_mtime_ns:
+            return DataDelta(changed=False, total=len(manifest.get("examples", {})))
+
+        digest = file_sha256(self.data_path)
+        new_entry = {"path": self.data_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+        if entry.get("path") == self.data_path and entry.get("sha256") == digest:
+            # 只是被 touch / 重新检出，内容没变：刷新 mtime，下次走快速路径
+            manifest["file"] = new_entry
+            self._save(manifest)
+            return DataDelta(changed=False, total=len(manifest.get("examples", {})))
+
+        old = manifest.get("examples", {})
+        new = example_digests(df_loader(self.data_path))
+        delta = DataDelta(
+            changed=True,
+            added=sorted(new.keys() - old.keys()),
+            removed=sorted(old.keys() - new.keys()),
+            modified=sorted(k for k in new.keys() & old.keys() if new[k] != old[k]),
+            total=len(new),
+            first_run=not old,
+            _pending={"file": new_entry, "examples": new},
+        )
+        # 文件改了但样本层面没有任何差异（如只改了格式 / 未标注字段）
+        if not (delta.added or delta.removed or delta.modified or delta.first_run):
+            delta.changed = False
+            self.commit(delta)
+        return delta
+
+    def commit(self, delta: DataDelta):
+        """模型通过门禁并完成保存 / 版本化后调用，之后相同数据不再触发训练；被门禁拒绝时不调用，下次重试"""
+        if delta._pending is not None:
+            self._save(delta._pending)
+            delta._pending = None
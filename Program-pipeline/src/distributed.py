@@ -0,0 +1,91 @@
+# src/distributed.py
+"""
+CPU 多进程数据并行（torch.distributed + gloo）
+用 torchrun 启动时从环境变量读取 RANK / WORLD_SIZE，直接 python 运行时退化为单进程
+    torchrun --standalone --nproc_per_node=4 src/train.py
+"""
+import os
+from typing import List
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+def init_distributed() -> bool:
+    """WORLD_SIZE > 1 时初始化进程组，返回是否处于分布式模式"""
+    if int(os.environ.get("WORLD_SIZE", "1")) <= 1 or dist.is_initialized():
+        return dist.is_initialized()
+    dist.init_process_group(backend="gloo")
+    print(f"🌐 rank {get_rank()}/{get_world_size()} joined (gloo)")
+    return True
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main() -> bool:
+    """只有 rank 0 写 MLflow、保存模型、执行 DVC"""
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def default_threads_per_rank() -> int:
+    """
+    torchrun 默认把 OMP_NUM_THREADS 设为 1，这里按同机进程数平分物理核
+    （params.yaml 里显式设置了 num_threads 时以配置为准）
+    """
+    local_world = int(os.environ.get("LOCAL_WORLD_SIZE", get_world_size()))
+    return max(1, (os.cpu_count() or 1) // local_world)
+
+
+def broadcast_object(obj, src: int = 0):
+    """把 rank 0 上的决定（如“数据是否变化”）同步给所有进程"""
+    if not is_distributed():
+        return obj
+    holder = [obj]
+    dist.broadcast_object_list(holder, src=src)
+    return holder[0]
+
+
+def all_reduce_sum(value: float) -> float:
+    if not is_distributed():
+        return value
+    t = torch.tensor([value], dtype=torch.float64)
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.item()
+
+
+def all_reduce_max(value: float) -> float:
+    if not is_distributed():
+        return value
+    t = torch.tensor([value], dtype=torch.float64)
+    dist.all_reduce(t, op=dist.ReduceOp.MAX)
+    return t.item()
+
+
+def all_gather_arrays(array: np.ndarray) -> np.ndarray:
+    """按 rank 顺序拼接各进程的数组（各进程行数可以不同）"""
+    if not is_distributed():
+        return array
+    parts: List[np.ndarray] = [None] * get_world_size()
+    dist.all_gather_object(parts, array)
+    return np.concatenate(parts)
@@ -1,68 +1,124 @@
-# src/evaluate.py（部分更新）
-from sklearn.metrics import roc_curve, auc
-from sklearn.preprocessing import label_binarize
-import matplotlib.pyplot as plt
-import torch
+# src/evaluate.py
+"""
+评估：一次前向拿到全部概率，指标全部向量化计算
+ROC 图在后台线程绘制并上传，不占用门禁判断的关键路径
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import mlflow
 import numpy as np
+import torch
+from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, roc_auc_score, roc_curve
+from sklearn.preprocessing import label_binarize
+
 from data import ID2LABEL
-import mlflow
+from distributed import all_gather_arrays, is_main
+
+REPORT_DIR = "reports"
+ROC_PATH = f"{REPORT_DIR}/roc_curve.png"
+
+_plot_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="roc-plot")
+_pending = []
 
-def evaluate_model(model, dataloader, device, num_labels=5):
+
+def predict(model, dataloader, device):
+    """推理模式下逐批前向，返回 (概率, 标签)；分布式时汇总所有进程的结果"""
     model.eval()
-    all_logits = []
-    all_labels = []
-
-    with torch.no_grad():
-        for batch in dataloader:
-            # print(type(batch))  # 看看到底是什么
-            # print(batch)  # 打印结构
-            input_ids = batch[0].to(device)  # 原来是 batch['input_ids']
-            attention_mask = batch[1].to(device)  # 原来是 batch['attention_mask']
-            labels = batch[2].to(device)  # 原来是 batch['labels']
-            # input_ids = batch['input_ids'].to(device)
-            # attention_mask = batch['attention_mask'].to(device)
-            # labels = batch['labels'].to(device)
-
-            outputs = model(input_ids, attention_mask)
-            all_logits.append(outputs.cpu().numpy())
-            all_labels.extend(labels.cpu().numpy())
-
-    # 合并 logits
-    all_logits = np.vstack(all_logits)
-    all_probs = torch.softmax(torch.tensor(all_logits), dim=1).numpy()
-
-    # 独热编码标签
-    y_test_bin = label_binarize(all_labels, classes=list(range(num_labels)))
-
-    # 计算每个类的 AUC
-    fpr = dict()
-    tpr = dict()
-    roc_auc = dict()
-    for i in range(num_labels):
-        fpr[i], tpr[i], _ = roc_curve(y_test_bin[:, i], all_probs[:, i])
-        roc_auc[i] = auc(fpr[i], tpr[i])
-
-    # 平均 AUC
-    auc_macro = np.mean(list(roc_auc.values()))
-
-    # 绘图
-    plt.figure(figsize=(8, 6))
+    probs, labels = [], []
+    with torch.inference_mode():
+        for input_ids, attention_mask, batch_labels in dataloader:
+            logits = model(input_ids.to(device), attention_mask.to(device))
+            probs.append(torch.softmax(logits.float(), dim=1).cpu().numpy())
+            labels.append(batch_labels.numpy())
+    num_labels = len(ID2LABEL)
+    local_probs = np.vstack(probs) if probs else np.empty((0, num_labels), dtype=np.float32)
+    local_labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.int64)
+    return all_gather_arrays(local_probs), all_gather_arrays(local_labels)
+
+
+def compute_metrics(labels, probs, num_labels=5):
+    """宏平均 AUC、各类 AUC / F1、准确率、混淆矩阵；测试集中没出现的类不参与 AUC 平均"""
+    if len(labels) == 0:
+        raise ValueError("Cannot compute metrics on an empty evaluation set")
+    y_bin = label_binarize(labels, classes=list(range(num_labels)))
+    present = [i for i in range(num_labels) if 0 < y_bin[:, i].sum() < len(labels)]
+    per_class_auc = np.full(num_labels, np.nan)
+    if present:
+        per_class_auc[present] = roc_auc_score(y_bin[:, present], probs[:, present], average=None)
+    preds = probs.argmax(axis=1)
+    classes = list(range(num_labels))
+    per_class_f1 = f1_score(labels, preds, labels=classes, average=None, zero_division=0)
+    return {
+        "auc_macro": float(np.nanmean(per_class_auc)) if present else float("nan"),
+        "auc_per_class": per_class_auc,
+        "f1_macro": float(per_class_f1.mean()),
+        "f1_per_class": per_class_f1,
+        "accuracy": float(accuracy_score(labels, preds)),
+        "confusion_matrix": confusion_matrix(labels, preds, labels=classes),
+    }
+
+
+def _plot_roc(labels, probs, per_class_auc, auc_macro, run_id):
+    # 面向对象接口 + Agg 画布，不经过 pyplot 全局状态，可以安全地在后台线程里绘制
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    y_bin = label_binarize(labels, classes=list(range(len(ID2LABEL))))
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
     for i, label_name in ID2LABEL.items():
-        plt.plot(fpr[i], tpr[i], lw=2, label=f'{label_name} (AUC = {roc_auc[i]:.2f})')
+        if np.isnan(per_class_auc[i]):
+            continue
+        fpr, tpr, _ = roc_curve(y_bin[:, i], probs[:, i])
+        ax.plot(fpr, tpr, lw=2, label=f'{label_name} (AUC = {per_class_auc[i]:.2f})')
+    ax.plot([0, 1], [0, 1], 'k--', lw=1)
+    ax.set_xlabel('False Positive Rate')
+    ax.set_ylabel('True Positive Rate')
+    ax.set_title(f'Multi-class ROC Curve (Macro AUC = {auc_macro:.2f})')
+    ax.legend(loc='lower right', fontsize='small')
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    fig.savefig(ROC_PATH, dpi=300, bbox_inches='tight')
+    if run_id:
+        mlflow.MlflowClient().log_artifact(run_id, ROC_PATH)
+    return ROC_PATH
+
+
+def wait_for_artifacts():
+    """等后台绘图 / 上传完成（DVC 提交报告文件前调用），返回生成的文件列表"""
+    paths = [f.result() for f in _pending]
+    _pending.clear()
+    return paths
 
-    plt.plot([0, 1], [0, 1], 'k--', lw=1)
-    plt.xlabel('False Positive Rate')
-    plt.ylabel('True Positive Rate')
-    plt.title(f'Multi-class ROC Curve (Macro AUC = {auc_macro:.2f})')
-    plt.legend(loc='lower right', fontsize='small')
-    roc_path = "reports/roc_curve.png"
-    plt.savefig(roc_path, dpi=300, bbox_inches='tight')
-    plt.close()
+
+def evaluate_model(model, dataloader, device, num_labels=5, prefix="test", plot=True):
+    probs, labels = predict(model, dataloader, device)
+    metrics = compute_metrics(labels, probs, num_labels)
+    auc_macro = metrics["auc_macro"]
+    if not is_main():
+        return auc_macro
 
     # MLflow 记录
-    mlflow.log_metric("test_auc_macro", auc_macro)
-    for i in range(num_labels):
-        mlflow.log_metric(f"test_auc_{ID2LABEL[i]}", roc_auc[i])
-    mlflow.log_artifact(roc_path)
+    mlflow.log_metrics({
+        f"{prefix}_auc_macro": auc_macro,
+        f"{prefix}_f1_macro": metrics["f1_macro"],
+        f"{prefix}_accuracy": metrics["accuracy"],
+        **{f"{prefix}_auc_{ID2LABEL[i]}": v for i, v in enumerate(metrics["auc_per_class"]) if not np.isnan(v)},
+        **{f"{prefix}_f1_{ID2LABEL[i]}": float(v) for i, v in enumerate(metrics["f1_per_class"])},
+    })
+    mlflow.log_dict({
+        "labels": [ID2LABEL[i] for i in range(num_labels)],
+        "matrix": metrics["confusion_matrix"].tolist(),
+    }, f"{prefix}_confusion_matrix.json")
+    print(f"📊 {prefix}: AUC={auc_macro:.3f} F1={metrics['f1_macro']:.3f} ACC={metrics['accuracy']:.3f}")
+    print(json.dumps(metrics["confusion_matrix"].tolist()))
+
+    if plot:
+        run = mlflow.active_run()
+        _pending.append(_plot_pool.submit(
+            _plot_roc, labels, probs, metrics["auc_per_class"], auc_macro, run.info.run_id if run else None
+        ))
 
-    return auc_macro
\ No newline at end of file
+    return auc_macro
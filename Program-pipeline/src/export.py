@@ -0,0 +1,206 @@
+# src/export.py
+"""
+门禁通过后导出推理产物
+- TorchScript（trace）与 ONNX：部署端不再需要 transformers / AutoModel.from_pretrained
+- 动态 int8 量化（nn.Linear）：CPU 推理更快、文件更小
+每个变体都在测试集上与 fp32 原模型比较准确率差异，超出容忍度的不会发布；延迟和体积记录到 MLflow
+trace 只见过一种输入形状，发布前还要在多种批大小 / 序列长度上与导出前的模块逐项比对输出
+"""
+import copy
+import inspect
+import json
+import os
+import time
+import warnings
+from typing import Dict, List
+
+import mlflow
+import numpy as np
+import torch
+
+EXPORT_DIR = "models/export"
+PROBE_ATOL = 1e-3  # 导出模型与导出前模块在探测形状上的 logits 最大允许差
+
+
+def _predict(forward, batches) -> np.ndarray:
+    """本进程内逐批推理，返回 logits（不做分布式汇总，只在 rank 0 上调用）"""
+    outputs = []
+    with torch.inference_mode():
+        for input_ids, attention_mask, _ in batches:
+            outputs.append(np.asarray(forward(input_ids, attention_mask), dtype=np.float32))
+    return np.vstack(outputs) if outputs else np.empty((0, 0), dtype=np.float32)
+
+
+def _latency_ms(forward, input_ids, attention_mask, warmup=3, runs=20) -> float:
+    with torch.inference_mode():
+        for _ in range(warmup):
+            forward(input_ids, attention_mask)
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            forward(input_ids, attention_mask)
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def _torch_forward(module):
+    return lambda ids, mask: module(ids, mask).float().numpy()
+
+
+def _onnx_forward(path):
+    import onnxruntime as ort
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    return lambda ids, mask: session.run(
+        ["logits"], {"input_ids": ids.numpy(), "attention_mask": mask.numpy()}
+    )[0]
+
+
+def export_torchscript(model, example, path):
+    # BERT 的输出是 ModelOutput（字典），strict=False 才能 trace
+    traced = torch.jit.trace(model, example, strict=False)
+    traced = torch.jit.freeze(traced.eval())
+    torch.jit.save(traced, path)
+    return torch.jit.load(path)
+
+
+def export_onnx(model, example, path, opset=17):
+    """导出 ONNX，并返回 onnxruntime 上的前向函数"""
+    # torch >= 2.9 默认走 dynamo 导出，需要额外的 onnxscript；这里固定用 TorchScript 导出器
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        model, example, path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"},
+                      "logits": {0: "batch"}},
+        opset_version=opset,
+        **kwargs,
+    )
+    return _onnx_forward(path)
+
+
+def quantize_dynamic_int8(model):
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _probe_shapes(example_ids, example_mask, max_length=None):
+    """trace 示例之外的输入形状：批大小 1 / 一半 / 全部 × 序列长度 1/4 / 原长 / 补齐到 max_length"""
+    batch, length = example_ids.shape
+    lengths = {max(1, length // 4), length}
+    if max_length and max_length > length:
+        lengths.add(min(max_length, length * 2))
+    for size in sorted({1, max(1, batch // 2), batch}):
+        for seq in sorted(lengths):
+            ids, mask = example_ids[:size, :seq], example_mask[:size, :seq]
+            if seq > length:
+                # 补齐部分 attention_mask 为 0，取什么 token 不影响输出
+                ids = torch.nn.functional.pad(ids, (0, seq - length), value=0)
+                mask = torch.nn.functional.pad(mask, (0, seq - length), value=0)
+            yield ids, mask
+
+
+def check_shapes(forward, reference, probes, atol=PROBE_ATOL):
+    """导出模型在每种探测形状上的输出都要和导出前的模块一致，否则抛 ValueError"""
+    checked = 0
+    with torch.inference_mode():
+        for ids, mask in probes:
+            try:
+                expected = reference(ids, mask)
+            except Exception:
+                continue  # 原模型本身不支持的形状（如超过位置编码长度）不作要求
+            actual = np.asarray(forward(ids, mask), dtype=np.float32)
+            diff = float(np.abs(actual - expected).max()) if actual.shape == expected.shape else float("inf")
+            if diff > atol:
+                raise ValueError(f"output mismatch for input shape {tuple(ids.shape)}: max |diff| = {diff:.3g}")
+            checked += 1
+    return checked
+
+
+def export_model(model, dataloader, formats: List[str] = ("torchscript", "onnx"), quantize: bool = True,
+                 max_accuracy_drop: float = 0.01, out_dir: str = EXPORT_DIR,
+                 reference_path: str = None, max_length: int = None) -> Dict[str, Dict]:
+    """
+    导出并校验各推理变体，返回 {变体名: {path, accuracy, accuracy_delta, agreement, latency_ms, size_mb, accepted}}
+    max_length 为推理时的最大序列长度，用于形状探测；失败的变体为 {path, accepted: False, error}；被拒绝或失败的变体文件会被删除，通过的变体写入 out_dir/export.json 供推理服务选择
+    """
+    batches = list(dataloader)
+    if not batches:
+        print("⚠️ Empty test set, skipping export.")
+        return {}
+    os.makedirs(out_dir, exist_ok=True)
+    model = copy.deepcopy(model).cpu().eval()
+    labels = np.concatenate([batch[2].numpy() for batch in batches])
+    # 用 token 数最多的一批做 trace 示例和延迟基准
+    example_ids, example_mask, _ = max(batches, key=lambda b: b[0].numel())
+    example = (example_ids, example_mask)
+
+    # 变体名 → (构建函数(路径) → (导出后的前向, 导出前模块的前向), 文件名)
+    def torchscript(module):
+        return lambda p: (_torch_forward(export_torchscript(module, example, p)), _torch_forward(module))
+
+    variants = {}
+    if "torchscript" in formats:
+        variants["torchscript_fp32"] = (torchscript(model), "model_fp32.pt")
+        if quantize:
+            variants["torchscript_int8"] = (lambda p: torchscript(quantize_dynamic_int8(model))(p), "model_int8.pt")
+    if "onnx" in formats:
+        try:
+            import onnxruntime  # noqa: F401  可选依赖，只有导出 ONNX 时需要
+            variants["onnx_fp32"] = (lambda p: (export_onnx(model, example, p), _torch_forward(model)), "model_fp32.onnx")
+        except ImportError:
+            warnings.warn("onnxruntime not installed, skipping ONNX export")
+
+    baseline = _torch_forward(model)
+    base_logits = _predict(baseline, batches)
+    base_acc = float((base_logits.argmax(1) == labels).mean())
+    results = {"eager_fp32": {
+        "accuracy": base_acc,
+        "latency_ms": _latency_ms(baseline, *example),
+        "accepted": True,
+    }}
+    if reference_path and os.path.exists(reference_path):
+        results["eager_fp32"]["size_mb"] = os.path.getsize(reference_path) / 2 ** 20
+
+    for name, (build, filename) in variants.items():
+        path = os.path.join(out_dir, filename)
+        # 导出、推理校验、测速任何一步出错都只让这个变体失败，不影响其他变体和已保存的模型
+        try:
+            forward, reference = build(path)
+            probes = check_shapes(forward, reference, _probe_shapes(*example, max_length))
+            logits = _predict(forward, batches)
+            acc = float((logits.argmax(1) == labels).mean())
+            info = {
+                "path": path,
+                "accuracy": acc,
+                "accuracy_delta": acc - base_acc,
+                "agreement": float((logits.argmax(1) == base_logits.argmax(1)).mean()),
+                "latency_ms": _latency_ms(forward, *example),
+                "size_mb": os.path.getsize(path) / 2 ** 20,
+                "shape_probes": probes,
+                "accepted": base_acc - acc <= max_accuracy_drop,
+            }
+        except Exception as e:
+            warnings.warn(f"Export {name} failed: {type(e).__name__}: {e}")
+            results[name] = {"path": path, "accepted": False, "error": f"{type(e).__name__}: {e}"}
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        if not info["accepted"]:
+            print(f"❌ {name}: accuracy drop {base_acc - acc:.4f} > {max_accuracy_drop}, discarded")
+            os.remove(path)
+        results[name] = info
+
+    for name, info in results.items():
+        if "error" in info:
+            mlflow.log_param(f"export_{name}_error", info["error"][:250])  # MLflow 参数值长度有限
+            continue
+        mlflow.log_metrics({f"export_{name}_{k}": float(v) for k, v in info.items() if k != "path"})
+        if info.get("accepted") and info.get("path"):
+            mlflow.log_artifact(info["path"], artifact_path="export")
+        print(f"📦 {name}: acc={info['accuracy']:.4f} latency={info['latency_ms']:.1f}ms"
+              + (f" size={info['size_mb']:.1f}MB" if "size_mb" in info else ""))
+
+    with open(os.path.join(out_dir, "export.json"), "w", encoding="utf-8") as f:
+        json.dump({name: info for name, info in results.items() if info.get("accepted") and info.get("path")},
+                  f, ensure_ascii=False, indent=2)
+    return results
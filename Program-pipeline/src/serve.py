@@ -0,0 +1,195 @@
+# src/serve.py
+"""
+通知分类推理服务（微批）
+- 进程启动时加载一次门禁通过的模型：优先用 models/export 里延迟最低的 TorchScript 产物，否则回退到 latest_model.pth
+- 并发请求先进入 asyncio 队列，由调度协程攒成微批（最多 MAX_BATCH_SIZE 条 / 最多等 MAX_WAIT_MS）
+- 分词 + 前向在单独的工作线程里执行，事件循环始终不被阻塞
+启动：
+    cd Program-pipeline && uvicorn serve:app --app-dir src --host 0.0.0.0 --port 8200
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import torch
+import yaml
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from data import ID2LABEL
+from token_cache import get_tokenizer
+
+PARAMS_PATH = os.getenv("PARAMS_PATH", "params.yaml")
+MODEL_PATH = os.getenv("MODEL_PATH", "models/latest_model.pth")
+EXPORT_DIR = os.getenv("EXPORT_DIR", "models/export")   # export.py 的导出目录
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "5"))
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "1024"))        # 排队上限，超出直接返回 503
+NUM_THREADS = int(os.getenv("NUM_THREADS", "0"))       # 0 为 PyTorch 默认
+
+
+def load_model(model_name: str, num_labels: int):
+    """返回 (模型, 来源描述)；导出产物不需要 transformers 建图"""
+    manifest = os.path.join(EXPORT_DIR, "export.json")
+    if os.path.exists(manifest):
+        with open(manifest, encoding="utf-8") as f:
+            exported = json.load(f)
+        scripted = {k: v for k, v in exported.items() if k.startswith("torchscript") and os.path.exists(v["path"])}
+        if scripted:
+            name, info = min(scripted.items(), key=lambda kv: kv[1]["latency_ms"])
+            return torch.jit.load(info["path"]).eval(), name
+
+    from model import SimpleClassifier
+    model = SimpleClassifier(model_name, num_labels)
+    model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
+    return model.eval(), "eager_fp32"
+
+
+class Predictor:
+    def __init__(self, params_path: str = PARAMS_PATH):
+        with open(params_path) as f:
+            params = yaml.safe_load(f)
+        self.max_length = params['data']['max_length']
+        self.tokenizer = get_tokenizer(params['model']['name'])
+        self.model, self.variant = load_model(params['model']['name'], params['model']['num_labels'])
+
+    def __call__(self, texts: List[str]) -> List[Dict]:
+        enc = self.tokenizer(texts, truncation=True, max_length=self.max_length, padding=True, return_tensors="pt")
+        with torch.inference_mode():
+            logits = self.model(enc["input_ids"], enc["attention_mask"])
+        probs = torch.softmax(logits.float(), dim=1)
+        results = []
+        for row in probs.tolist():
+            label_id = max(range(len(row)), key=row.__getitem__)
+            results.append({
+                "label": ID2LABEL[label_id],
+                "label_id": label_id,
+                "scores": {ID2LABEL[i]: round(p, 6) for i, p in enumerate(row)},
+            })
+        return results
+
+
+class MicroBatcher:
+    """把并发请求合并成微批，在单个工作线程里串行执行；计算当前批时下一批继续排队"""
+
+    def __init__(self, predict, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS,
+                 max_queue: int = MAX_QUEUE):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="classifier")
+        self.batches = 0
+        self.items = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, text: str) -> Dict:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="classifier queue is full")
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # 已经在排队的请求直接取走，不用等
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # 客户端已断开的请求不再计算
+            batch = [(text, fut) for text, fut in batch if not fut.cancelled()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self.executor, self.predict, [text for text, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+
+batcher: MicroBatcher = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global batcher
+    if NUM_THREADS:
+        torch.set_num_threads(NUM_THREADS)
+    predictor = Predictor()
+    print(f"🧠 Classifier loaded ({predictor.variant}), max_batch={MAX_BATCH_SIZE}, max_wait={MAX_WAIT_MS}ms")
+    predictor(["warm up"])  # 首次前向较慢，启动时预热
+    batcher = MicroBatcher(predictor)
+    batcher.start()
+    app.state.variant = predictor.variant
+    yield
+    await batcher.stop()
+
+
+app = FastAPI(title="Notice Classifier", version="0.1.0", lifespan=lifespan)
+
+
+class ClassifyRequest(BaseModel):
+    text: str
+
+
+class ClassifyBatchRequest(BaseModel):
+    texts: List[str]
+
+
+@app.post("/classify")
+async def classify(request: ClassifyRequest):
+    start = time.perf_counter()
+    result = await batcher.submit(request.text)
+    return {**result, "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+
+@app.post("/classify/batch")
+async def classify_batch(request: ClassifyBatchRequest):
+    # 客户端自带的批也拆成单条入队，和其他并发请求一起组批
+    return {"results": await asyncio.gather(*(batcher.submit(t) for t in request.texts))}
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "model": app.state.variant,
+        "batches": batcher.batches,
+        "avg_batch_size": round(batcher.items / batcher.batches, 2) if batcher.batches else 0,
+        "queue_depth": batcher.queue.qsize(),
+    }
@@ -0,0 +1,136 @@
+# src/token_cache.py
+"""
+预分词缓存
+- 按 (分词器名, max_length) 分目录，目录内按文本哈希索引
+- token 序列不补齐，首尾相接存成扁平 int32 数组，训练时用 np.memmap 零拷贝读取
+- 只对缓存里没有的文本调用分词器，每周增量重训的启动时间随新增样本而不是全量语料增长
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+
+TOKEN_CACHE_DIR = "data/token_cache"
+KEY_BYTES = 16
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_BYTES).digest()
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str):
+    """同一进程内每个分词器只加载一次；缓存全部命中时根本不会加载"""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+class TokenCache:
+    """
+    目录内文件：
+    - tokens.bin  : int32，所有样本的 token 首尾相接
+    - offsets.bin : int64，每个样本在 tokens.bin 中的结束位置
+    - keys.bin    : 每个样本的文本哈希（16 字节），行号即样本编号
+    - meta.json   : 行数、token 数、pad_token_id；最后原子写入，中断留下的半截数据会被忽略
+    """
+
+    def __init__(self, tokenizer_name: str, max_length: int, root: str = TOKEN_CACHE_DIR):
+        slug = re.sub(r'[^\w.-]+', '_', tokenizer_name)
+        self.dir = os.path.join(root, f"{slug}__{max_length}")
+        self.tokenizer_name = tokenizer_name
+        self.max_length = max_length
+        os.makedirs(self.dir, exist_ok=True)
+        self.meta = self._load_meta()
+        self._open()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def _load_meta(self) -> Dict:
+        if os.path.exists(self._path('meta.json')):
+            with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {"tokenizer": self.tokenizer_name, "max_length": self.max_length,
+                "rows": 0, "tokens": 0, "pad_token_id": None}
+
+    def _save_meta(self):
+        tmp = self._path('meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self._path('meta.json'))
+
+    def _memmap(self, name: str, dtype, count: int) -> np.ndarray:
+        # 空文件无法 mmap
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path(name), dtype=dtype, mode='r', shape=(count,))
+
+    def _open(self):
+        rows, tokens = self.meta['rows'], self.meta['tokens']
+        self.tokens = self._memmap('tokens.bin', np.int32, tokens)
+        self.offsets = np.concatenate([[0], self._memmap('offsets.bin', np.int64, rows)])
+        keys = b''
+        if rows:
+            with open(self._path('keys.bin'), 'rb') as f:
+                keys = f.read(rows * KEY_BYTES)
+        self.index = {keys[i:i + KEY_BYTES]: i // KEY_BYTES for i in range(0, len(keys), KEY_BYTES)}
+
+    def __getstate__(self):
+        # DataLoader 多进程时只传路径和元数据，子进程里重新 mmap，不拷贝数组
+        return {k: v for k, v in self.__dict__.items() if k not in ('tokens', 'offsets', 'index')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self) -> int:
+        return self.meta['rows']
+
+    @property
+    def pad_token_id(self) -> int:
+        return self.meta['pad_token_id'] or 0
+
+    def _append_file(self, name: str, data: bytes, keep: int):
+        # 先截断到 meta 记录的长度，丢掉上次中断留下的半截数据，再追加
+        with open(self._path(name), 'ab') as f:
+            f.truncate(keep)
+            f.write(data)
+
+    def _append(self, missing: Dict[bytes, str]):
+        tokenizer = get_tokenizer(self.tokenizer_name)
+        ids = tokenizer(list(missing.values()), truncation=True, max_length=self.max_length)['input_ids']
+        lengths = np.fromiter(map(len, ids), dtype=np.int64, count=len(ids))
+        flat = np.fromiter(itertools.chain.from_iterable(ids), dtype=np.int32, count=int(lengths.sum()))
+        ends = self.meta['tokens'] + np.cumsum(lengths)
+
+        rows, tokens = self.meta['rows'], self.meta['tokens']
+        self._append_file('tokens.bin', flat.tobytes(), tokens * 4)
+        self._append_file('offsets.bin', ends.astype(np.int64).tobytes(), rows * 8)
+        self._append_file('keys.bin', b''.join(missing), rows * KEY_BYTES)
+        self.meta.update(rows=rows + len(missing), tokens=int(ends[-1]), pad_token_id=tokenizer.pad_token_id)
+        self._save_meta()
+        self._open()
+
+    def rows_for(self, texts: List[str]) -> np.ndarray:
+        """返回每条文本在缓存中的行号，缺失的文本先分词并追加"""
+        keys = [text_key(t) for t in texts]
+        missing = {}
+        for k, t in zip(keys, texts):
+            if k not in self.index:
+                missing.setdefault(k, t)  # 重复文本只分词一次
+        if missing:
+            self._append(missing)
+        print(f"🧩 分词缓存命中 {len(texts) - len(missing)}/{len(texts)}，新分词 {len(missing)} 条")
+        return np.fromiter((self.index[k] for k in keys), dtype=np.int64, count=len(keys))
+
+    def sequence(self, row: int) -> np.ndarray:
+        """单个样本的 token（memmap 切片，不拷贝）"""
+        return self.tokens[self.offsets[row]:self.offsets[row + 1]]
+
+    def lengths(self, rows: np.ndarray) -> np.ndarray:
+        return self.offsets[rows + 1] - self.offsets[rows]
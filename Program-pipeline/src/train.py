@@ -3,90 +3,182 @@ import os
 import torch
 import mlflow
 import hashlib
+import json
+import time
 import yaml
-from torch.utils.data import DataLoader, TensorDataset
-from data import load_data, tokenize_data
+from contextlib import nullcontext
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from data import load_data, tokenize_data, stratified_split, incremental_subset
+from data_manifest import DataManifest
+from batching import BucketBatchSampler, PadCollate
 from model import SimpleClassifier
-from evaluate import evaluate_model
-import os
-import shutil
+from evaluate import evaluate_model, wait_for_artifacts
+from checkpoint import CheckpointManager, EarlyStopping
+from export import export_model, EXPORT_DIR
+from distributed import (
+    init_distributed, cleanup, is_distributed, is_main, get_rank, get_world_size, barrier,
+    broadcast_object, all_reduce_sum, all_reduce_max, default_threads_per_rank
+)
 import subprocess
+
+
 def run_dvc_cmd(cmd):
-    os.environ['GIT_TRACE'] = '1'  # 看 Git 内部执行流
-    os.environ['GIT_TRACE_SETUP'] = '1'  # 看工作区/仓库路径
-    print('which git  :', shutil.which('git'))
-    print('cwd        :', os.getcwd())
-    print('exists Git :', os.path.exists(shutil.which('git')))
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
     print(f'>>> {cmd}')
-    print(f'  returncode : {result.returncode}')
-    print(f'  stdout     : {repr(result.stdout)}')
-    print(f'  stderr     : {repr(result.stderr)}')
+    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
     if result.returncode != 0:
         raise Exception(f"Command failed: {cmd}\n{result.stderr}")
-    print(result.stdout)
-# def run_dvc_cmd(cmd):
-#     # 用 bash 登录模式，加载 /etc/profile 和 ~/.bashrc
-#     result = subprocess.run(
-#         ['bash', '-l', '-c', cmd],
-#         capture_output=True,
-#         text=True,
-#         cwd='/media/administrator/Data2/wzy/xx/llm-ops'
-#     )
-#     print('>>>', cmd)
-#     print('returncode:', result.returncode)
-#     print('stdout:', repr(result.stdout))
-#     print('stderr:', repr(result.stderr))
-#     if result.returncode != 0:
-#         raise Exception(f"Command failed: {cmd}\n{result.stderr}")
-#     print(result.stdout)
-
-def check_data_changed():
-    """检查 DVC 数据是否有更新"""
-    result = subprocess.run("dvc status", shell=True, capture_output=True, text=True)
-    if "new" in result.stdout or "modified" in result.stdout:
-        print("✅ Data has changed, proceed with training.")
-        return True
+    if result.stdout.strip():
+        print(result.stdout.strip())
+
+
+def check_data_changed(data_path):
+    """对比数据清单（大小 / mtime 快速路径 + 内容哈希），返回逐条样本的增量"""
+    delta = DataManifest(data_path).detect(load_data)
+    if delta.changed:
+        print(f"✅ Data has changed ({delta.summary()}), proceed with training.")
     else:
         print("🚫 No data change detected, skip training.")
-        return False
+    return delta
+
+
+def configure_threads(perf):
+    """设置 PyTorch 线程数；必须在任何并行计算之前调用，0 表示使用默认值"""
+    if perf.get('num_threads'):
+        torch.set_num_threads(perf['num_threads'])
+    elif is_distributed():
+        torch.set_num_threads(default_threads_per_rank())
+    if perf.get('interop_threads'):
+        try:
+            torch.set_num_interop_threads(perf['interop_threads'])
+        except RuntimeError as e:  # 同一进程里已经启动过并行任务时只能设置一次
+            print(f"⚠️ interop_threads not applied: {e}")
+
+
+def loader_kwargs(perf, device):
+    """DataLoader 的多进程 / 锁页内存参数"""
+    workers = perf.get('num_workers', 0)
+    kwargs = {
+        "num_workers": workers,
+        # 锁页内存只对拷贝到 GPU 有意义
+        "pin_memory": bool(perf.get('pin_memory')) and device.type == "cuda",
+    }
+    if workers > 0:
+        kwargs["persistent_workers"] = True
+        kwargs["prefetch_factor"] = perf.get('prefetch_factor', 2)
+    return kwargs
+
+
+def validation_loss(model, dataloader, device, use_bf16=False):
+    """验证集平均交叉熵（分布式时汇总所有进程）"""
+    model.eval()
+    total, count = 0.0, 0
+    with torch.inference_mode():
+        for input_ids, attention_mask, labels in dataloader:
+            labels = labels.to(device)
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                outputs = model(input_ids.to(device), attention_mask.to(device))
+            total += torch.nn.functional.cross_entropy(outputs.float(), labels, reduction="sum").item()
+            count += len(labels)
+    return all_reduce_sum(total) / max(all_reduce_sum(count), 1)
+
+
+def run_fingerprint(dataset, params):
+    """训练数据（缓存行号 + 标签）与模型/训练超参的指纹，用来判断检查点能否续用"""
+    h = hashlib.sha256()
+    h.update(dataset.rows.tobytes())
+    h.update(dataset.labels.tobytes())
+    h.update(json.dumps([params['model'], params['training']], sort_keys=True).encode())
+    return h.hexdigest()
+
 
 def train():
-    # --- 1. 检查数据是否更新 ---
-    if not check_data_changed():
-        return {"status": "skipped", "reason": "no_data_change"}
+    """单进程直接运行；torchrun 启动时每个进程各跑一份，按 rank 分担批次"""
+    init_distributed()
+    try:
+        return _train()
+    finally:
+        cleanup()
 
-    # --- 2. 加载参数 ---
+
+def _train():
+    # --- 1. 加载参数 ---
     with open("params.yaml") as f:
         params = yaml.safe_load(f)
 
+    # --- 2. 检查数据是否更新（rank 0 判断后广播，各进程保持一致） ---
+    delta = broadcast_object(check_data_changed(params['data']['path']) if is_main() else None)
+    if not delta.changed:
+        return {"status": "skipped", "reason": "no_data_change"}
+
     model_name = params['model']['name']
     num_labels = params['model']['num_labels']
     epochs = params['training']['epochs']
     batch_size = params['training']['batch_size']
     lr = params['training']['learning_rate']
     max_length = params['data']['max_length']
+    perf = params.get('performance', {})
+    accum_steps = max(1, perf.get('grad_accum_steps', 1))
+    seed = params['training'].get('seed', 42)
+    configure_threads(perf)
+    torch.manual_seed(seed)
 
     # --- 3. 准备数据 ---
     df = load_data(params['data']['path'])
-    encodings, labels = tokenize_data(df, model_name, max_length)
-
-    dataset = TensorDataset(
-        encodings['input_ids'],
-        encodings['attention_mask'],
-        labels
-    )
-    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+    # rank 0 先补齐预分词缓存，其他进程等它写完再读，避免并发追加同一份缓存文件
+    if is_main():
+        dataset = tokenize_data(df, model_name, max_length, params['data']['token_cache'])
+    barrier()
+    if not is_main():
+        dataset = tokenize_data(df, model_name, max_length, params['data']['token_cache'])
 
     # --- 4. 设置设备 ---
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # CPU 上用 bf16 自动混合精度（需要 CPU 支持 AVX512-BF16/AMX 才有明显收益）
+    use_bf16 = bool(perf.get('bf16_autocast')) and device.type == "cpu"
 
-    # --- 5. 加载模型（支持增量训练）---
+    # 按样本键哈希分层划分：验证集用于早停，测试集只用于最终门禁；样本所属集合跨运行固定
+    train_idx, val_idx, test_idx = stratified_split(
+        df['key'], dataset.labels, params['training'].get('val_ratio', 0.1), params['training'].get('test_ratio', 0.1)
+    )
+    if not len(train_idx) or not len(test_idx):
+        raise ValueError(f"Empty split (train={len(train_idx)}, val={len(val_idx)}, test={len(test_idx)}, "
+                         f"total={len(df)}): need more labelled data or a larger test_ratio for the AUC gate")
+    # 已有模型且改动占比小：只在增量样本（加回放）上微调；否则全量重训
     model_path = "models/latest_model.pth"
+    incremental = (os.path.exists(model_path) and not delta.first_run
+                   and delta.ratio <= params['training'].get('incremental_max_delta_ratio', 0.2))
+    if incremental:
+        subset = incremental_subset(df['key'], train_idx, delta.delta_keys,
+                                    params['training'].get('replay_ratio', 1.0), seed)
+        if len(subset):
+            train_idx = subset
+            epochs = params['training'].get('incremental_epochs', 1)
+        else:
+            # 改动全部落在验证 / 测试集，或只有删除：没有可微调的样本，改为全量重训
+            print(f"⚠️ No changed examples in the training split ({delta.summary()}), falling back to full retrain")
+            incremental = False
+    print(f"🧭 Training mode: {'incremental' if incremental else 'full'}, {len(train_idx)} training examples")
+    train_set, val_set, test_set = dataset.subset(train_idx), dataset.subset(val_idx), dataset.subset(test_idx)
+    eval_batch_size = params.get('evaluation', {}).get('batch_size', batch_size)
+
+    # 长度相近的样本同批，每批只补齐到本批最长
+    collate = PadCollate(dataset.cache.pad_token_id)
+    train_sampler = BucketBatchSampler(train_set.lengths, batch_size, shuffle=True, seed=seed,
+                                       num_replicas=get_world_size(), rank=get_rank())
+    dataloader = DataLoader(train_set, batch_sampler=train_sampler, collate_fn=collate, **loader_kwargs(perf, device))
+    val_loader = DataLoader(
+        val_set,
+        batch_sampler=BucketBatchSampler(val_set.lengths, eval_batch_size, shuffle=False,
+                                         num_replicas=get_world_size(), rank=get_rank()),
+        collate_fn=collate
+    )
+
+    # --- 5. 加载模型（支持增量训练）---
     if os.path.exists(model_path):
         print(f"🔁 Loading existing model from {model_path}")
         model = SimpleClassifier(model_name, num_labels)
-        model.load_state_dict(torch.load(model_path))
+        model.load_state_dict(torch.load(model_path, map_location="cpu"))
     else:
         print("🆕 Initializing new model")
         model = SimpleClassifier(model_name, num_labels)
@@ -94,53 +186,134 @@ def train():
     lr = float(lr)
     optimizer = torch.optim.Adam(model.parameters(), lr=lr)
 
+    # 从上次中断的检查点继续（数据或超参变化时从头开始）
+    stopper = EarlyStopping(patience=params['training'].get('patience', 2),
+                            min_delta=params['training'].get('min_delta', 0.0))
+    checkpoints = CheckpointManager(params['training'].get('checkpoint_dir', 'models/checkpoints'),
+                                    every=params['training'].get('checkpoint_every', 1),
+                                    run_key=run_fingerprint(train_set, params))
+    start_epoch = checkpoints.resume(model, optimizer, stopper)
+    # DDP 在 backward 时用 gloo 对各进程梯度求平均；构造时以 rank 0 的参数为准
+    ddp_model = DistributedDataParallel(model) if is_distributed() else model
+    # 包装/编译后的模块只用于训练前向；保存、评估仍用原模型，state_dict 键名不带 module. / _orig_mod. 前缀
+    train_model = torch.compile(ddp_model) if perf.get('compile') else ddp_model
+
     # --- 6. MLflow 开始记录 ---
-    mlflow.set_tracking_uri("file:./mlruns")  # 本地
-    mlflow.set_experiment("nlp-text-classification")
+    if is_main():
+        mlflow.set_tracking_uri("file:./mlruns")  # 本地
+        mlflow.set_experiment("nlp-text-classification")
 
-    with mlflow.start_run() as run:
+    with (mlflow.start_run() if is_main() else nullcontext()) as run:
         # 记录参数
-        mlflow.log_params({
-            "model_name": model_name,
-            "epochs": epochs,
-            "batch_size": batch_size,
-            "learning_rate": lr,
-            "max_length": max_length
-        })
+        if is_main():
+            mlflow.log_params({
+                "model_name": model_name,
+                "epochs": epochs,
+                "batch_size": batch_size,
+                "learning_rate": lr,
+                "max_length": max_length,
+                "num_workers": perf.get('num_workers', 0),
+                "bf16_autocast": use_bf16,
+                "grad_accum_steps": accum_steps,
+                "effective_batch_size": batch_size * accum_steps,
+                "num_threads": torch.get_num_threads(),
+                "compile": bool(perf.get('compile')),
+                "world_size": get_world_size(),
+                "train_size": len(train_set),
+                "val_size": len(val_set),
+                "test_size": len(test_set),
+                "patience": stopper.patience,
+                "resumed_from_epoch": start_epoch,
+                "training_mode": "incremental" if incremental else "full",
+                "data_delta": delta.summary()
+            })
 
         # 训练循环
-        for epoch in range(epochs):
-
+        for epoch in range(start_epoch, epochs):
+            if stopper.stopped:  # 从已经触发早停的检查点恢复
+                break
+            train_sampler.set_epoch(epoch)
             model.train()
             total_loss = 0
-            for batch in dataloader:
+            samples = 0
+            epoch_start = time.perf_counter()
+            optimizer.zero_grad()
+            num_batches = len(dataloader)
+            for step, batch in enumerate(dataloader):
                 #print(batch)
-                input_ids = batch[0].to(device)
-                attention_mask = batch[1].to(device)
-                labels = batch[2].to(device)
+                input_ids = batch[0].to(device, non_blocking=True)
+                attention_mask = batch[1].to(device, non_blocking=True)
+                labels = batch[2].to(device, non_blocking=True)
 
-                optimizer.zero_grad()
-                outputs = model(input_ids, attention_mask)
-                loss = torch.nn.functional.cross_entropy(outputs, labels)
-                loss.backward()
-                optimizer.step()
+                # 梯度累积：每 accum_steps 个小批更新一次，等效批大小 = batch_size * accum_steps * 进程数
+                update = (step + 1) % accum_steps == 0 or step + 1 == num_batches
+                # 不更新参数的小批跳过 DDP 的梯度同步，只在更新前同步一次
+                sync = ddp_model.no_sync() if is_distributed() and not update else nullcontext()
+                with sync:
+                    with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                        outputs = train_model(input_ids, attention_mask)
+                    loss = torch.nn.functional.cross_entropy(outputs.float(), labels)
+                    (loss / accum_steps).backward()
+                if update:
+                    optimizer.step()
+                    optimizer.zero_grad()
 
                 total_loss += loss.item()
+                samples += len(labels)
+
+            # 各进程的损失、样本数求和，耗时取最慢的进程
+            elapsed = all_reduce_max(time.perf_counter() - epoch_start)
+            avg_loss = all_reduce_sum(total_loss) / max(all_reduce_sum(num_batches), 1)
+            samples = all_reduce_sum(samples)
+            elapsed = max(elapsed, 1e-9)
+            if is_main():
+                mlflow.log_metric("loss", avg_loss, step=epoch)
+                mlflow.log_metric("train_samples_per_sec", samples / elapsed, step=epoch)
+                print(f"epoch[{epoch}] avg_loss[{avg_loss}] {samples / elapsed:.1f} samples/s")
 
-            avg_loss = total_loss / len(dataloader)
-            mlflow.log_metric("loss", avg_loss, step=epoch)
-            print(f"epoch[{epoch}] avg_loss[{avg_loss}]")
+            # 各进程拿到的是汇总后的同一个验证损失，早停判断一致
+            val_loss = validation_loss(model, val_loader, device, use_bf16)
+            stop = stopper.step(val_loss, model, epoch) if len(val_set) else False
+            if is_main():
+                mlflow.log_metric("val_loss", val_loss, step=epoch)
+                print(f"epoch[{epoch}] val_loss[{val_loss}]")
+                checkpoints.save(epoch, model, optimizer, stopper, force=stop)
+            if stop:
+                print(f"⏹️ Early stopping at epoch {epoch}, best epoch {stopper.best_epoch}")
+                break
+
+        # 回退到验证损失最好的权重
+        stopper.restore_best(model)
+        if is_main() and stopper.best_epoch >= 0:
+            mlflow.log_metric("best_val_loss", stopper.best_loss)
+            mlflow.log_metric("best_epoch", stopper.best_epoch)
         # --- 7. 评估模型 ---
-        test_dataloader = DataLoader(dataset, batch_size=batch_size)  # 简化：用全量数据评估
-        auc_score = evaluate_model(model, test_dataloader, device)
+        # 留出的测试集，门禁反映真实泛化能力
+        test_dataloader = DataLoader(
+            test_set,
+            batch_sampler=BucketBatchSampler(test_set.lengths, eval_batch_size, shuffle=False,
+                                             num_replicas=get_world_size(), rank=get_rank()),
+            collate_fn=collate
+        )
+        plot = params.get('evaluation', {}).get('plot', True)
+        auc_score = evaluate_model(model, test_dataloader, device, num_labels, plot=plot)
 
-        # --- 8. 模型门禁：AUC < 0.8 不保存 ---
-        if auc_score < 0.8:
+        # --- 8. 模型门禁：AUC < 0.8 不保存（测试集过小算不出 AUC 时同样拒绝） ---
+        if not auc_score >= 0.8:
             print(f"❌ AUC={auc_score:.3f} < 0.8, skipping model save and DVC commit.")
+            if is_main():
+                checkpoints.clear()
+                wait_for_artifacts()
+                # 不提交数据清单：这批变更保持"未训练"，修复回归后下次运行会重新训练
             return {"status": "rejected", "auc": auc_score}
 
+        # 保存、MD5、MLflow 注册、DVC 提交只在 rank 0 做一次
+        if not is_main():
+            return {"status": "success", "auc": auc_score, "rank": get_rank()}
+
         # --- 9. 保存模型 + 计算 MD5 ---
         torch.save(model.state_dict(), model_path)
+        checkpoints.clear()  # 本次训练已完整结束，下次从最新模型重新开始
         hash_md5 = hashlib.md5()
         with open(model_path, "rb") as f:
             for chunk in iter(lambda: f.read(4096), b""):
@@ -163,15 +336,45 @@ def train():
 
         print(f"✅ Model trained, AUC={auc_score:.3f}, MD5={model_md5}")
 
+        # 导出 TorchScript / ONNX 及 int8 量化版本，校验准确率差异并记录延迟、体积
+        # 放在注册之后，且导出失败只记录不中断：模型照常版本化，数据清单照常提交
+        export_cfg = params.get('export', {})
+        exported = {}
+        if export_cfg.get('enabled', True):
+            full_test_loader = DataLoader(
+                test_set, batch_sampler=BucketBatchSampler(test_set.lengths, eval_batch_size, shuffle=False),
+                collate_fn=collate
+            )  # 本进程内完整测试集（分布式时其他进程已退出，不能再做汇总）
+            try:
+                exported = export_model(
+                    model, full_test_loader,
+                    formats=export_cfg.get('formats', ["torchscript", "onnx"]),
+                    quantize=export_cfg.get('quantize', True),
+                    max_accuracy_drop=export_cfg.get('max_accuracy_drop', 0.01),
+                    out_dir=EXPORT_DIR,
+                    reference_path=model_path,
+                    max_length=max_length,
+                )
+            except Exception as e:
+                print(f"⚠️ Export failed, keeping the trained model only: {e}")
+                mlflow.log_param("export_error", f"{type(e).__name__}: {e}"[:250])
+            exported = {k: v for k, v in exported.items() if v.get("accepted") and v.get("path")}
+
         # --- 11. DVC 提交 ---
         run_dvc_cmd("dvc add models/latest_model.pth")
         run_dvc_cmd("dvc add models/latest_model.md5")
-        run_dvc_cmd("dvc add reports/roc_curve.png")
+        if exported:
+            run_dvc_cmd(f"dvc add {EXPORT_DIR}")
+        for report in wait_for_artifacts():  # 后台绘制的 ROC 图写完再交给 DVC
+            run_dvc_cmd(f"dvc add {report}")
         os.system(f'git commit -m "feat: trained model with AUC={auc_score:.3f}, MD5={model_md5}" --no-verify')  # 跳过钩子
         # run_dvc_cmd("git add models/latest_model.pth.dvc models/latest_model.md5.dvc reports/roc_curve.png.dvc params.yaml")
         # run_dvc_cmd("git add models/latest_model.pth.dvc models/latest_model.md5.dvc reports/roc_curve.png.dvc")
         # run_dvc_cmd(f'git commit -m "feat: trained model with AUC={auc_score:.3f}, MD5={model_md5}"')
 
+        # 模型保存、注册、版本化都完成后最后提交数据清单；中途失败的话下次还会重新训练这批数据
+        DataManifest(params['data']['path']).commit(delta)
+
         return {"status": "success", "auc": auc_score, "md5": model_md5}
 
 if __name__ == '__main__':
@@ -1,36 +1,179 @@
 # label_studio/import_to_ls.py
 import label_studio_sdk
+import hashlib
 import os
-import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from processor.jsonl import iter_records, iter_chunks
 
-# 连接到 Label Studio
-client = label_studio_sdk.Client('http://localhost:8080', r'4a337092f603b7a1de8d7e2c3ca05acf0ccda653')  # 在 LS 设置中生成 API Key
-print('API 版本:', client.get_versions())     # 先测通
-#print(client.list_projects())
-# 选择项目（先手动创建一个）
-project = client.get_project(2)               # 再拿项目
+# 连接配置（API Key 在 LS 设置中生成）
+LS_URL = os.getenv("LABEL_STUDIO_URL", "http://localhost:8080")
+LS_API_KEY = os.getenv("LABEL_STUDIO_API_KEY", "4a337092f603b7a1de8d7e2c3ca05acf0ccda653")
+LS_PROJECT_ID = int(os.getenv("LABEL_STUDIO_PROJECT_ID", "2"))  # 先手动创建一个项目
 
+LEDGER_PATH = "data/ls_ledger.sqlite"  # 已导入任务的本地台账
+IMPORT_CHUNK_SIZE = 200
+IMPORT_RETRIES = 3
 
+_project = None
+_lock = threading.Lock()
 
-def import_to_label_studio(cleaned_file):
-    with open(cleaned_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
 
-    # 构造导入数据
-    tasks = []
-    for item in data:
-        tasks.append({
-            "data": {
-                "title": item["title"],
-                "content": item["content"],
-                "url": item["url"]
-            }
-        })
+def get_project():
+    """第一次真正导入时才连接 Label Studio，之后复用"""
+    global _project
+    if _project is None:
+        with _lock:
+            if _project is None:
+                client = label_studio_sdk.Client(LS_URL, LS_API_KEY)
+                print('API 版本:', client.get_versions())     # 先测通
+                _project = client.get_project(LS_PROJECT_ID)  # 再拿项目
+    return _project
 
-    # 导入
-    project.import_tasks(tasks)
-    print(f"✅ 已导入 {len(tasks)} 条数据到 Label Studio")
+
+def task_hash(data):
+    return hashlib.sha256(f"{data['url']}\0{data['title']}\0{data['content']}".encode('utf-8')).hexdigest()
+
+
+class Ledger:
+    """记录已导入项目的任务 (url, 内容哈希)，每天只上传增量"""
+
+    def __init__(self, path=LEDGER_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS imported (hash TEXT PRIMARY KEY, url TEXT, imported_at TEXT)"
+        )
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM imported LIMIT 1").fetchone() is None
+
+    def filter_new(self, tasks, reserved=None):
+        """
+        台账里没有的任务；reserved 为已提交、尚未确认上传成功的任务哈希集合，
+        选中的任务会立即加入其中，并发在途的两块不会重复上传同一条任务
+        """
+        hashes = [task_hash(t["data"]) for t in tasks]
+        placeholders = ','.join('?' * len(hashes))
+        known = {row[0] for row in self.conn.execute(
+            f"SELECT hash FROM imported WHERE hash IN ({placeholders})", hashes
+        )}
+        # 同一批里重复的任务也只保留一条
+        fresh = {}
+        for h, t in zip(hashes, tasks):
+            if h not in known and (reserved is None or h not in reserved):
+                fresh.setdefault(h, t)
+        if reserved is not None:
+            reserved.update(fresh)
+        return list(fresh.values())
+
+    def record(self, tasks):
+        now = datetime.now().isoformat()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO imported VALUES (?, ?, ?)",
+            ((task_hash(t["data"]), t["data"]["url"], now) for t in tasks)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def sync_ledger_from_project(ledger):
+    """台账为空时（首次使用或台账丢失）用项目里已有的任务补齐，避免整批重复导入"""
+    tasks = [
+        {"data": t["data"]} for t in get_project().get_tasks()
+        if all(k in t.get("data", {}) for k in ("url", "title", "content"))
+    ]
+    ledger.record(tasks)
+    print(f"📒 已从项目同步 {len(tasks)} 条任务到本地台账")
+
+
+def to_task(item):
+    return {
+        "data": {
+            "title": item["title"],
+            "content": item["content"],
+            "url": item["url"]
+        }
+    }
+
+
+def upload_chunk(tasks):
+    """上传一块任务，失败按指数退避重试"""
+    for attempt in range(IMPORT_RETRIES + 1):
+        try:
+            get_project().import_tasks(tasks)
+            return tasks
+        except Exception as e:
+            if attempt == IMPORT_RETRIES:
+                raise
+            delay = 2 ** attempt
+            print(f"⚠️ 导入失败（{e}），{delay}s 后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+
+
+def import_chunk(records, ledger):
+    """同步导入一块记录，返回实际上传条数（流式管道逐批调用）"""
+    tasks = ledger.filter_new([to_task(item) for item in records])
+    if tasks:
+        ledger.record(upload_chunk(tasks))
+    return len(tasks)
+
+
+def import_to_label_studio(cleaned_file, chunk_size=IMPORT_CHUNK_SIZE, parallel=1):
+    """
+    分块导入：跳过台账中已有的任务，只上传增量
+    parallel > 1 时多块并发上传；台账只在对应块上传成功后写入，提交时先在内存里预留任务哈希
+    """
+    ledger = Ledger()
+    if ledger.is_empty():
+        sync_ledger_from_project(ledger)
+
+    imported = skipped = 0
+    errors = []
+    reserved = set()  # 在途任务的哈希
+
+    def drain(future, tasks):
+        nonlocal imported
+        hashes = {task_hash(t["data"]) for t in tasks}
+        try:
+            done = future.result()
+        except Exception as e:
+            errors.append(e)
+            reserved.difference_update(hashes)  # 上传失败不记台账，下次运行重新上传
+            return
+        ledger.record(done)
+        reserved.difference_update(hashes)  # 已在台账里，不必再占内存
+        imported += len(done)
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        in_flight = []
+        for records in iter_chunks(iter_records(cleaned_file), chunk_size):
+            tasks = ledger.filter_new([to_task(item) for item in records], reserved)
+            skipped += len(records) - len(tasks)
+            if tasks:
+                in_flight.append((pool.submit(upload_chunk, tasks), tasks))
+            # 在途块数有上限，内存不随文件大小增长
+            while len(in_flight) > parallel:
+                drain(*in_flight.pop(0))
+        for future, tasks in in_flight:
+            drain(future, tasks)
+    ledger.close()
+
+    print(f"✅ 已导入 {imported} 条数据到 Label Studio，跳过已存在 {skipped} 条")
+    if errors:
+        raise RuntimeError(f"{len(errors)} 块导入失败（已成功的块已记入台账）: {errors[0]}")
+    return imported
 
 
 if __name__ == '__main__':
-    import_to_label_studio(cleaned_file="./processor/data/cleaned/notices_clean_latest.json")
\ No newline at end of file
+    from processor.clean_dedup import latest_clean_file
+    cleaned_file = latest_clean_file()
+    if cleaned_file:
+        import_to_label_studio(cleaned_file=cleaned_file)
+    else:
+        print("❌ 没有清洗后的数据文件，请先运行清洗")
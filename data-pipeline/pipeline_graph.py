@@ -0,0 +1,185 @@
+# scripts/pipeline_graph.py
+"""
+小型阶段图执行器
+- 每个阶段声明依赖与输入文件，输入指纹（路径 + 大小 + mtime）未变化时直接复用上次结果
+- 依赖都完成的阶段并发执行（如向量入库与 Label Studio 导入）
+- 每个阶段记录耗时、处理条数、峰值内存，整次运行写一份 JSON 报告
+"""
+import hashlib
+import json
+import os
+import resource
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, List, Union
+
+STATE_PATH = "data/pipeline_state.json"
+REPORT_DIR = "data/reports"
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[dict], dict]                 # 参数为上游结果 {阶段名: 结果}，返回可 JSON 序列化的 dict，其中 items 为处理条数
+    deps: List[str] = field(default_factory=list)
+    inputs: Union[List[str], Callable[[dict], List[str]]] = field(default_factory=list)  # 也可按上游结果动态给出
+    always_run: bool = False                     # 外部数据源（如爬虫）没有本地输入可比对，每次都跑
+
+
+def fingerprint(paths: list) -> str:
+    """输入文件/目录的指纹：只看路径、大小、mtime，不读内容"""
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+        else:
+            files = [path]
+        for f in files:
+            try:
+                st = os.stat(f)
+                h.update(f"{f}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+            except FileNotFoundError:
+                h.update(f"{f}\0missing\n".encode())
+    return h.hexdigest()
+
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        # 非 Linux 退回到进程历史峰值（Linux 单位 KB，macOS 单位字节）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RssSampler:
+    """阶段执行期间每 50ms 采样一次进程 RSS，取峰值（并发阶段共享同一进程，峰值互相包含）"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = _current_rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss_mb())
+
+
+class PipelineRunner:
+    def __init__(self, stages: List[Stage], state_path=STATE_PATH, report_dir=REPORT_DIR, max_workers=4):
+        self.stages = {s.name: s for s in stages}
+        self.state_path = state_path
+        self.report_dir = report_dir
+        self.max_workers = max_workers
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self, state):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def _execute(self, stage: Stage, results: dict, state: dict) -> dict:
+        record = {"stage": stage.name, "started_at": datetime.now().isoformat()}
+        inputs = stage.inputs(results) if callable(stage.inputs) else stage.inputs
+        if not stage.always_run and (inputs is None or None in inputs):
+            # 上游没有产出（例如没有新数据），本阶段无事可做
+            return {**record, "status": "no_input", "wall_time_s": 0.0, "items": 0, "result": {}}
+
+        fp = fingerprint(inputs) if not stage.always_run else None
+        previous = state.get(stage.name)
+        if fp and previous and previous.get("fingerprint") == fp:
+            return {**record, "status": "cached", "wall_time_s": 0.0, "items": 0,
+                    "fingerprint": fp, "result": previous.get("result", {})}
+
+        start = time.perf_counter()
+        with RssSampler() as rss:
+            try:
+                result = stage.func(results) or {}
+                status, error = "success", None
+            except Exception:
+                result, status, error = {}, "failed", traceback.format_exc()
+        record.update({
+            "status": status,
+            "wall_time_s": round(time.perf_counter() - start, 3),
+            "items": result.get("items"),
+            "peak_rss_mb": round(rss.peak, 1),
+            "fingerprint": fp,
+            "result": result,
+        })
+        if error:
+            record["error"] = error
+        return record
+
+    def run(self) -> dict:
+        state = self._load_state()
+        results, records = {}, {}
+        pending = dict(self.stages)
+        run_start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+            while pending or running:
+                # 上游失败的阶段直接标记跳过
+                for name, stage in list(pending.items()):
+                    failed = [d for d in stage.deps if records.get(d, {}).get("status") in ("failed", "upstream_failed")]
+                    if failed:
+                        records[name] = {"stage": name, "status": "upstream_failed", "failed_deps": failed}
+                        del pending[name]
+                ready = [s for s in pending.values() if all(d in results for d in s.deps)]
+                for stage in ready:
+                    del pending[stage.name]
+                    print(f"▶️  [{stage.name}] 开始")
+                    running[pool.submit(self._execute, stage, dict(results), state)] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    record = future.result()
+                    records[stage.name] = record
+                    print(f"⏹️  [{stage.name}] {record['status']}，{record['wall_time_s']}s，"
+                          f"{record.get('items')} 条，峰值 {record.get('peak_rss_mb', '-')} MB")
+                    if record["status"] == "failed":
+                        print(record["error"])
+                        continue
+                    results[stage.name] = record["result"]
+                    if record["status"] == "success" and record.get("fingerprint"):
+                        state[stage.name] = {"fingerprint": record["fingerprint"], "result": record["result"]}
+
+        self._save_state(state)
+        failed = [n for n, r in records.items() if r["status"] in ("failed", "upstream_failed")]
+        report = {
+            "run_at": datetime.now().isoformat(),
+            "status": "failed" if failed else "success",
+            "wall_time_s": round(time.perf_counter() - run_start, 3),
+            "stages": [records[n] for n in self.stages if n in records],
+        }
+        os.makedirs(self.report_dir, exist_ok=True)
+        report_path = os.path.join(self.report_dir, f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 运行报告: {report_path}")
+        return report
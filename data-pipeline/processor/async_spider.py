@@ -0,0 +1,258 @@
+# processor/async_spider.py
+"""
+异步并发爬虫：连接池复用 + 并发上限 + 按域名限速 + 失败指数退避重试
+列表页与详情页并行抓取，返回与 crawl_notices 相同结构的通知字典
+"""
+import asyncio
+import inspect
+import os
+import random
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+import httpx
+
+from processor.crawl_index import CrawlIndex, INDEX_PATH
+from processor.jsonl import JsonlWriter
+from processor.notice_spider import HEADERS, LIST_PAGE_URL, parse_notice_list, extract_content
+
+# 这些状态码视为临时故障，退避后重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    """按域名限速：同一 host 相邻两次请求至少间隔 1/rate_per_host 秒"""
+
+    def __init__(self, rate_per_host: float):
+        self.interval = 1.0 / rate_per_host if rate_per_host > 0 else 0.0
+        self._next_slot = {}
+
+    async def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        # 事件循环单线程，预约时间片这一步无需加锁
+        slot = max(now, self._next_slot.get(host, 0.0))
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncFetcher:
+    """
+    共享 keep-alive 连接池的异步抓取器
+    concurrency 同时限制在途请求数与连接池大小
+    """
+
+    def __init__(self, concurrency=8, rate_per_host=4.0, retries=3, backoff=0.5, timeout=15.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = HostRateLimiter(rate_per_host)
+        self.client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+
+    async def get(self, url: str, headers=None) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            await self.limiter.wait(url)
+            response = None
+            try:
+                async with self.semaphore:
+                    response = await self.client.get(url, headers=headers)
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code != 304:  # 条件请求命中，交给调用方处理
+                        response.raise_for_status()
+                    response.encoding = 'utf-8'  # 强制 UTF-8 防止乱码
+                    return response
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} for {url}", request=response.request, response=response
+                )
+            except httpx.TransportError as e:
+                error = e
+
+            if attempt == self.retries:
+                raise error
+            delay = self._retry_delay(attempt, response)
+            print(f"⚠️ 请求失败（{error}），{delay:.1f}s 后第 {attempt + 1} 次重试: {url}")
+            await asyncio.sleep(delay)
+
+
+async def _emit(sink, notice: dict):
+    """sink 可以是普通函数，也可以是协程函数（下游满时在这里挂起，只暂停当前这条，不阻塞事件循环）"""
+    result = sink(notice)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _fill_content(fetcher: AsyncFetcher, notice: dict, sink=None) -> dict:
+    try:
+        response = await fetcher.get(notice['url'])
+        notice['content'] = extract_content(response.text)
+    except httpx.HTTPError as e:
+        # 单条详情失败不影响整体，content 保持为空
+        print(f"⚠️ 详情页抓取失败: {notice['url']} ({e})")
+    if sink is not None:
+        await _emit(sink, notice)
+    return notice
+
+
+async def fetch_details(notices: list, sink=None, **fetcher_kwargs) -> list:
+    """
+    详情页抓取阶段：并发补全每条通知的 content
+    sink(notice) 在每条完成时立即回调（完成顺序），可用于边抓边落盘
+    """
+    async with AsyncFetcher(**fetcher_kwargs) as fetcher:
+        return await asyncio.gather(*(_fill_content(fetcher, n, sink) for n in notices))
+
+
+def stream_details(notices: list, filename: str, **fetcher_kwargs) -> int:
+    """同步入口：抓取详情页并逐条追加写入 JSONL，返回写入条数"""
+    with JsonlWriter(filename) as writer:
+        asyncio.run(fetch_details(notices, sink=writer.write, **fetcher_kwargs))
+    return writer.count
+
+
+async def _crawl_page(fetcher: AsyncFetcher, page: int, fetch_detail: bool, sink=None) -> list:
+    response = await fetcher.get(LIST_PAGE_URL.format(page=page))
+    notices = parse_notice_list(response.text)
+    if fetch_detail:
+        # 列表页一到就开始抓本页详情，不必等其他列表页
+        await asyncio.gather(*(_fill_content(fetcher, n, sink) for n in notices))
+    elif sink is not None:
+        for notice in notices:
+            await _emit(sink, notice)
+    print(f"第 {page} 页完成，{len(notices)} 条")
+    return notices if sink is None else []
+
+
+async def crawl_notices_async(max_pages=5, fetch_detail=True, sink=None, **fetcher_kwargs) -> list:
+    """
+    并发抓取 1..max_pages 列表页（及详情页）
+    未传 sink 时按页序返回通知列表；传入 sink 时逐条回调、不在内存中累积，返回空列表
+    fetcher_kwargs 透传给 AsyncFetcher（concurrency / rate_per_host / retries ...）
+    """
+    async with AsyncFetcher(**fetcher_kwargs) as fetcher:
+        pages = await asyncio.gather(
+            *(_crawl_page(fetcher, page, fetch_detail, sink) for page in range(1, max_pages + 1))
+        )
+    return [notice for page in pages for notice in page]
+
+
+def run_async_crawl(max_pages=5, fetch_detail=True, **fetcher_kwargs) -> str:
+    """同步入口：异步抓取，边抓边写 data/raw 下的 JSONL，返回文件名"""
+    print(f"🚀 异步并发爬取 {max_pages} 页通知公告...")
+    start = time.perf_counter()
+
+    os.makedirs("data/raw", exist_ok=True)
+    filename = f"data/raw/notices_all_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    with JsonlWriter(filename) as writer:
+        asyncio.run(crawl_notices_async(max_pages, fetch_detail, sink=writer.write, **fetcher_kwargs))
+
+    print(f"✅ 爬取完成，共 {writer.count} 条，耗时 {time.perf_counter() - start:.1f}s，保存到 {filename}")
+    return filename
+
+
+async def _detail_incremental(fetcher: AsyncFetcher, index: CrawlIndex, notice: dict, sink) -> bool:
+    url = notice['url']
+    try:
+        response = await fetcher.get(url, headers=index.conditional_headers(url))
+    except httpx.HTTPError as e:
+        # 失败的不写索引，下次运行会重新尝试
+        print(f"⚠️ 详情页抓取失败: {url} ({e})")
+        return False
+    if response.status_code == 304:
+        index.touch(url)
+        return False
+
+    notice['content'] = extract_content(response.text)
+    changed = index.update(
+        url,
+        f"{notice['title']}\n{notice['content']}",
+        etag=response.headers.get('ETag'),
+        last_modified=response.headers.get('Last-Modified')
+    )
+    if changed:
+        await _emit(sink, notice)
+    return changed
+
+
+async def crawl_incremental_async(index: CrawlIndex, sink, max_pages=50, page_window=4, commit=True,
+                                  **fetcher_kwargs) -> dict:
+    """
+    增量抓取：列表页按窗口并发翻页，遇到整页都已抓过的列表页即停止
+    详情页带 ETag / Last-Modified 条件请求，只有新增或内容变更的通知才回调 sink（普通函数或协程函数）
+    commit=True 时每个窗口结束后提交索引；sink 只是把通知交给下游时传 False，
+    由调用方在下游确认处理完后再 index.commit()（失败则 index.rollback()），否则通知会被记为已抓取而丢失
+    """
+    stats = {"pages": 0, "emitted": 0}
+    async with AsyncFetcher(**fetcher_kwargs) as fetcher:
+        page = 1
+        reached_seen = False
+        while page <= max_pages and not reached_seen:
+            window = list(range(page, min(page + page_window, max_pages + 1)))
+            responses = await asyncio.gather(*(fetcher.get(LIST_PAGE_URL.format(page=p)) for p in window))
+
+            pending = []
+            for response in responses:
+                notices = parse_notice_list(response.text)
+                stats["pages"] += 1
+                # 列表按时间倒序，整页都见过说明更早的页也都抓过了
+                reached_seen = not notices or all(index.seen(n['url']) for n in notices)
+                pending.extend(notices)
+                if reached_seen:
+                    break
+
+            results = await asyncio.gather(*(_detail_incremental(fetcher, index, n, sink) for n in pending))
+            stats["emitted"] += sum(results)
+            if commit:
+                index.commit()
+            page += page_window
+    return stats
+
+
+def run_incremental_crawl(max_pages=50, index_path=INDEX_PATH, **fetcher_kwargs):
+    """
+    同步入口：增量抓取，只把新增/变更的通知写入 data/raw 下的 JSONL
+    返回文件名；没有任何变化时返回 None 且不留空文件
+    """
+    print("🚀 增量爬取通知公告...")
+    start = time.perf_counter()
+
+    os.makedirs("data/raw", exist_ok=True)
+    filename = f"data/raw/notices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    index = CrawlIndex(index_path)
+    try:
+        with JsonlWriter(filename) as writer:
+            stats = asyncio.run(crawl_incremental_async(index, writer.write, max_pages, **fetcher_kwargs))
+    finally:
+        index.close()
+
+    elapsed = time.perf_counter() - start
+    if not writer.count:
+        os.remove(filename)
+        print(f"🟰 翻了 {stats['pages']} 页，没有新增或变更的通知，耗时 {elapsed:.1f}s")
+        return None
+    print(f"✅ 翻了 {stats['pages']} 页，新增/变更 {writer.count} 条，耗时 {elapsed:.1f}s，保存到 {filename}")
+    return filename
+
+
+if __name__ == '__main__':
+    run_async_crawl(max_pages=3)
@@ -1,50 +1,191 @@
 # processor/clean_dedup.py
 import pandas as pd
 import re
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.utils import embedding_functions
-import os
+import hashlib
 import json
+import os
+import sqlite3
+from datetime import datetime
+from processor.jsonl import iter_records, iter_chunks
+from processor.near_dedup import NearDupIndex
 
 
-# 加载模型
-model = SentenceTransformer('./all-MiniLM-L6-v2')  # 中文也支持，轻量
-ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="./all-MiniLM-L6-v2")
+RAW_DIR = "data/raw"
+CLEAN_DIR = "data/cleaned"
+MANIFEST_PATH = f"{CLEAN_DIR}/manifest.json"   # 已清洗的原始文件清单
+INGESTED_PATH = f"{CLEAN_DIR}/ingested_{{sink}}.json"  # 各下游（向量库 / Label Studio）已处理完的清洗输出
+DEDUP_DB_PATH = f"{CLEAN_DIR}/dedup.sqlite"    # 标题+日期去重键，跨文件、跨运行生效
+CHUNK_SIZE = 5000                              # 每块最多处理的记录数，决定内存上限
+NEAR_DUP_THRESHOLD = 0.85                      # 近似重复的 Jaccard 阈值，None 关闭语义去重
 
 def clean_text(text):
     text = re.sub(r'\s+', ' ', text)  # 多空格变单空格
     return text.strip()
 
-def load_and_clean():
-    # 读取最新爬取文件
-    files = sorted([f for f in os.listdir('data/raw') if f.startswith('notices_')])
-    if not files:
-        print("❌ 无原始数据文件")
+def clean_series(s: pd.Series) -> pd.Series:
+    """clean_text 的向量化版本"""
+    return s.fillna('').astype(str).str.replace(r'\s+', ' ', regex=True).str.strip()
+
+def clean_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """清洗一块记录，并做块内 标题 + 日期 精确去重"""
+    for col in ('title', 'content', 'publish_date'):
+        if col not in df:
+            df[col] = ''
+    df['content_clean'] = clean_series(df['content'])
+    df['title_clean'] = clean_series(df['title'])
+    return df.drop_duplicates(subset=['title_clean', 'publish_date'])
+
+def _load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def _save_manifest(manifest):
+    tmp = MANIFEST_PATH + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, MANIFEST_PATH)
+
+def _manifest_entry(path, n_in, n_out, clean_file):
+    return {
+        "size": os.path.getsize(path),
+        "records": n_in,
+        "kept": n_out,
+        "cleaned_at": datetime.now().isoformat(),
+        "output": os.path.basename(clean_file) if clean_file else None
+    }
+
+def mark_cleaned(name, n_in, n_out, clean_file):
+    """把已在别处（如流式管道）清洗过的原始文件登记到清单，批处理清洗时跳过"""
+    manifest = _load_manifest()
+    manifest[name] = _manifest_entry(f"{RAW_DIR}/{name}", n_in, n_out, clean_file)
+    _save_manifest(manifest)
+
+def pending_raw_files(manifest):
+    """未清洗过（或清洗后又被改写）的原始文件，按文件名即时间顺序"""
+    pending = []
+    for name in sorted(os.listdir(RAW_DIR)):
+        if not name.startswith('notices_') or not name.endswith(('.json', '.jsonl')):
+            continue
+        entry = manifest.get(name)
+        if entry is None or entry['size'] != os.path.getsize(f"{RAW_DIR}/{name}"):
+            pending.append(name)
+    return pending
+
+def _load_ingested(sink):
+    path = INGESTED_PATH.format(sink=sink)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def pending_clean_files(sink):
+    """
+    sink 还没处理完的清洗输出，按文件名即时间顺序
+    包括之前运行里清洗已提交、但该下游失败留下的文件，不只是最新一份
+    """
+    if not os.path.isdir(CLEAN_DIR):
         return []
+    done = _load_ingested(sink)
+    pending = []
+    for name in sorted(os.listdir(CLEAN_DIR)):
+        if not name.startswith("notices_clean_") or not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(CLEAN_DIR, name)
+        if done.get(name) != os.path.getsize(path):
+            pending.append(path)
+    return pending
+
+def mark_ingested(sink, clean_file):
+    """sink 成功处理完 clean_file 后登记（按文件大小，文件被改写后会重新处理）"""
+    done = _load_ingested(sink)
+    done[os.path.basename(clean_file)] = os.path.getsize(clean_file)
+    path = INGESTED_PATH.format(sink=sink)
+    os.makedirs(CLEAN_DIR, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(done, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def latest_clean_file():
+    """最近一次清洗输出的 JSONL（单独运行入库 / 导入脚本时用），没有则返回 None"""
+    if not os.path.isdir(CLEAN_DIR):
+        return None
+    files = [os.path.join(CLEAN_DIR, f) for f in os.listdir(CLEAN_DIR)
+             if f.startswith("notices_clean_") and f.endswith(".jsonl")]
+    return max(files, key=os.path.getmtime, default=None)
 
-    latest_file = f"data/raw/{files[-1]}"
-    with open(latest_file, 'r', encoding='utf-8') as f:
-        data = pd.json_normalize(json.load(f))
 
-    data['content_clean'] = data['content'].astype(str).apply(clean_text)
-    data['title_clean'] = data['title'].astype(str).apply(clean_text)
+def drop_seen(df: pd.DataFrame, conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    按持久化的去重键剔除之前运行里已出现过的 标题 + 日期 + 正文
+    正文也参与键，增量爬虫重发的"内容已变更"通知才能继续往下游走
+    """
+    keys = (df['title_clean'] + '\x1f' + df['publish_date'].astype(str) + '\x1f' + df['content_clean']).map(
+        lambda k: hashlib.sha1(k.encode('utf-8')).hexdigest()
+    )
+    placeholders = ','.join('?' * len(keys))
+    seen = {row[0] for row in conn.execute(
+        f"SELECT key FROM dedup_keys WHERE key IN ({placeholders})", keys.tolist()
+    )}
+    mask = ~keys.isin(seen)
+    conn.executemany("INSERT OR IGNORE INTO dedup_keys VALUES (?)", ((k,) for k in keys[mask]))
+    return df[mask]
+
+def load_and_clean(chunk_size=CHUNK_SIZE, near_dup_threshold=NEAR_DUP_THRESHOLD):
+    """
+    流式清洗：逐个处理 manifest 中未记录的原始文件，每次只读 chunk_size 条
+    精确去重后再做 MinHash 近似去重，与历史已入库的通知增量比对
+    输出本次新增的 JSONL，返回 (写入条数, 文件路径)；无待处理文件时返回 (0, None)
+    """
+    if not os.path.isdir(RAW_DIR):
+        print("❌ 无原始数据文件")
+        return 0, None
+
+    os.makedirs(CLEAN_DIR, exist_ok=True)
+    manifest = _load_manifest()
+    files = pending_raw_files(manifest)
+    if not files:
+        print("🟰 没有未清洗的原始文件")
+        return 0, None
 
-    # 去重：先按标题 + 日期去重
-    data.drop_duplicates(subset=['title_clean', 'publish_date'], inplace=True)
+    conn = sqlite3.connect(DEDUP_DB_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS dedup_keys (key TEXT PRIMARY KEY)")
+    near_index = NearDupIndex(conn, threshold=near_dup_threshold) if near_dup_threshold else None
 
-    # 语义去重（可选，耗时）
-    # 这里只做向量化入库，去重可在查询时做
+    # 带微秒，同一秒内的两次运行不会互相覆盖输出
+    clean_file = f"{CLEAN_DIR}/notices_clean_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jsonl"
+    total = 0
+    with open(clean_file, 'w', encoding='utf-8') as out:
+        for name in files:
+            path = f"{RAW_DIR}/{name}"
+            n_in = n_out = 0
+            for records in iter_chunks(iter_records(path), chunk_size):
+                n_in += len(records)
+                df = drop_seen(clean_chunk(pd.DataFrame.from_records(records)), conn)
+                if near_index is not None and not df.empty:
+                    df = near_index.filter_df(df)
+                if df.empty:
+                    continue
+                out.write(df.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+                n_out += len(df)
 
-    # 保存清洗后数据
-    os.makedirs("data/cleaned", exist_ok=True)
-    #clean_file = f"data/cleaned/cleaned_{os.path.basename(latest_file)}"
-    clean_file = f"data/cleaned/notices_clean_latest.json"
-    data.to_json(clean_file, force_ascii=False, orient='records', indent=2)
+            # 整个文件写完才提交去重键、近似去重索引和清单，中途失败下次会重新处理该文件
+            conn.commit()
+            manifest[name] = _manifest_entry(path, n_in, n_out, clean_file)
+            _save_manifest(manifest)
+            total += n_out
+            print(f"  {name}: {n_in} 条 → 保留 {n_out} 条")
+    conn.close()
 
-    print(f"✅ 清洗完成，保存到 {clean_file}")
-    return data.to_dict('records'), clean_file
+    if not total:
+        os.remove(clean_file)
+        print(f"🟰 {len(files)} 个文件均为重复数据，无新增")
+        return 0, None
+    print(f"✅ 清洗完成，{len(files)} 个文件共保留 {total} 条，保存到 {clean_file}")
+    return total, clean_file
 
 
 if __name__ == '__main__':
-    load_and_clean()
\ No newline at end of file
+    load_and_clean()
@@ -0,0 +1,86 @@
+# processor/crawl_index.py
+"""
+已抓取 URL 的持久化索引（SQLite）
+记录 ETag / Last-Modified 用于条件请求，记录内容哈希用于判断是否变更
+"""
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+
+INDEX_PATH = "data/crawl_index.sqlite"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class CrawlIndex:
+    def __init__(self, path: str = INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                first_seen TEXT,
+                last_crawled TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def _row(self, url: str):
+        return self.conn.execute(
+            "SELECT etag, last_modified, content_hash FROM pages WHERE url = ?", (url,)
+        ).fetchone()
+
+    def seen(self, url: str) -> bool:
+        return self._row(url) is not None
+
+    def conditional_headers(self, url: str) -> dict:
+        """按上次的校验值构造 If-None-Match / If-Modified-Since 请求头"""
+        row = self._row(url)
+        headers = {}
+        if row:
+            etag, last_modified, _ = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def update(self, url: str, text: str, etag: str = None, last_modified: str = None) -> bool:
+        """写入最新抓取结果，返回内容是否为新增或变更"""
+        new_hash = content_hash(text)
+        row = self._row(url)
+        now = datetime.now().isoformat()
+        if row is None:
+            self.conn.execute(
+                "INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, new_hash, now, now)
+            )
+            return True
+        self.conn.execute(
+            "UPDATE pages SET etag = ?, last_modified = ?, content_hash = ?, last_crawled = ? WHERE url = ?",
+            (etag, last_modified, new_hash, now, url)
+        )
+        return row[2] != new_hash
+
+    def touch(self, url: str):
+        """304 未变更时只刷新抓取时间"""
+        self.conn.execute(
+            "UPDATE pages SET last_crawled = ? WHERE url = ?", (datetime.now().isoformat(), url)
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        """放弃上次提交之后的更新，这些 URL 下次运行会重新抓取"""
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,40 @@
+# processor/embedding.py
+"""
+进程内共享的向量模型：第一次真正需要编码时才加载，且每个进程只加载一次
+爬虫、清洗等用不到模型的阶段不会为它付出启动时间和内存
+"""
+import os
+import threading
+
+import numpy as np
+
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "./all-MiniLM-L6-v2")   # 中文也支持，轻量
+BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+DEVICE = os.getenv("EMBEDDING_DEVICE") or None                     # None 时由 sentence-transformers 自动选择
+
+_model = None
+_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                # 延迟导入：torch / transformers 只在第一次编码时才被加载
+                from sentence_transformers import SentenceTransformer
+                print(f"🧠 加载向量模型 {MODEL_NAME}（device={DEVICE or 'auto'}）")
+                _model = SentenceTransformer(MODEL_NAME, device=DEVICE)
+    return _model
+
+
+def encode(texts: list, batch_size: int = None) -> np.ndarray:
+    """批量编码，返回 (len(texts), dim) 的 float32 数组"""
+    if not texts:
+        return np.empty((0, get_model().get_sentence_embedding_dimension()), dtype=np.float32)
+    return get_model().encode(
+        texts,
+        batch_size=batch_size or BATCH_SIZE,
+        show_progress_bar=False,
+        convert_to_numpy=True
+    ).astype(np.float32, copy=False)
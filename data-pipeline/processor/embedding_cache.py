@@ -0,0 +1,61 @@
+# processor/embedding_cache.py
+"""
+向量缓存：按 (模型名, 文本) 的哈希存 float32 向量
+同一段文本换了 ID、或向量库重建时都能直接复用，不用再跑模型
+"""
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+from processor.embedding import MODEL_NAME, encode
+
+CACHE_PATH = "data/embedding_cache.sqlite"
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB)")
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        # SQLite 单条语句参数个数有限，分批查
+        for start in range(0, len(keys), 900):
+            part = keys[start:start + 900]
+            placeholders = ','.join('?' * len(part))
+            for key, blob in self.conn.execute(
+                f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", part
+            ):
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, keys: list, vectors: np.ndarray):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+            ((k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in zip(keys, vectors))
+        )
+        self.conn.commit()
+
+    def encode(self, texts: list) -> np.ndarray:
+        """先查缓存，只对未命中的文本调用共享模型编码，结果写回缓存"""
+        keys = [cache_key(MODEL_NAME, t) for t in texts]
+        cached = self.get_many(keys)
+        # 同一批里重复的文本只编码一次
+        missing = list({k: i for i, k in enumerate(keys) if k not in cached}.values())
+        if missing:
+            vectors = encode([texts[i] for i in missing])
+            self.put_many([keys[i] for i in missing], vectors)
+            for i, v in zip(missing, vectors):
+                cached[keys[i]] = np.asarray(v, dtype=np.float32)
+        print(f"  向量缓存命中 {len(texts) - len(missing)}/{len(texts)}")
+        return np.stack([cached[k] for k in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+
+    def close(self):
+        self.conn.close()
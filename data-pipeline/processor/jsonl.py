@@ -0,0 +1,51 @@
+# processor/jsonl.py
+"""
+JSON Lines 读写工具：逐条落盘、逐条读取，避免整文件进内存
+"""
+import json
+from itertools import islice
+
+import ijson
+
+
+class JsonlWriter:
+    """逐行追加写 JSONL，行缓冲，进程中途退出也不会丢已写入的记录"""
+
+    def __init__(self, path: str, mode: str = 'w'):
+        self.path = path
+        self.count = 0
+        self._f = open(path, mode, encoding='utf-8', buffering=1)
+
+    def write(self, record: dict):
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_records(path: str):
+    """逐条读取记录，兼容 .jsonl 与旧的 JSON 数组文件（ijson 流式解析）"""
+    with open(path, 'rb') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from ijson.items(f, 'item', use_float=True)
+
+
+def iter_chunks(iterable, size: int):
+    """把可迭代对象切成最多 size 条的 list"""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,197 @@
+# processor/near_dedup.py
+"""
+MinHash + LSH 近似重复检测
+字符 k-gram 分片 → 单次排列 MinHash（one permutation hashing + 旋转补齐空桶）签名
+→ 按 band 分桶找候选 → 用签名估计 Jaccard 复核
+每个分片只哈希一次，签名代价 O(分片数 + num_perm)，与正文长度线性相关
+只比较同桶候选，复杂度近似线性；桶和签名存 SQLite，新数据可与历史库增量比对
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+MAX_HASH = np.uint64(0xFFFFFFFF)
+GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shingle_hashes(texts: list, k: int):
+    """
+    一批文本的字符 k-gram 32 位哈希，整批拼接后用 numpy 滚动多项式哈希一次算完
+    返回 (哈希数组, 每篇文档在数组中的起始下标)
+    """
+    texts = [t.ljust(k, '\0') for t in texts]  # 短于 k 的文本补齐，至少产生一个分片
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    powers = np.uint64(1000003) ** np.arange(k, dtype=np.uint64)
+    h = (windows * powers).sum(axis=1)  # uint64 溢出回绕即取模 2^64
+    h = (h ^ (h >> np.uint64(32))) & MAX_HASH
+
+    # 去掉跨越两篇文档边界的窗口
+    n_windows = lengths - k + 1
+    offsets = np.concatenate(([0], np.cumsum(n_windows)[:-1]))
+    text_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    valid = np.arange(n_windows.sum()) + np.repeat(text_starts - offsets, n_windows)
+    return h[valid], offsets
+
+
+def lsh_params(threshold: float, num_perm: int):
+    """选 band 数 b 和每 band 行数 r，使 S 曲线拐点 (1/b)^(1/r) 最接近阈值"""
+    best = None
+    for r in range(1, num_perm + 1):
+        b = num_perm // r
+        if b == 0:
+            break
+        gap = abs((1 / b) ** (1 / r) - threshold)
+        if best is None or gap < best[0]:
+            best = (gap, b, r)
+    return best[1], best[2]
+
+
+class NearDupIndex:
+    """
+    近似重复索引，数据存放在传入的 SQLite 连接中
+    conn 用 sqlite3.connect(':memory:') 即为单次运行内去重；用文件库则跨运行增量比对
+    """
+
+    def __init__(self, conn: sqlite3.Connection, threshold=0.85, num_perm=128, shingle_size=5, seed=42):
+        self.conn = conn
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = np.uint64(seed)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+
+        conn.execute("CREATE TABLE IF NOT EXISTS minhash_sigs (doc_id TEXT PRIMARY KEY, sig BLOB)")
+        # 主键即 (band, bucket) 查询索引，WITHOUT ROWID 只维护一棵 B 树
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS minhash_bands (
+                band INTEGER, bucket INTEGER, doc_id TEXT,
+                PRIMARY KEY (band, bucket, doc_id)
+            ) WITHOUT ROWID
+        """)
+
+    def signatures(self, texts: list) -> np.ndarray:
+        """批量计算 MinHash 签名，返回 (len(texts), num_perm) 的 uint32 矩阵"""
+        n, p = len(texts), self.num_perm
+        hv, offsets = shingle_hashes(texts, self.shingle_size)
+        counts = np.diff(np.append(offsets, len(hv)))
+
+        # 再混合一次得到均匀哈希：高位决定落入哪个桶，低 32 位作为桶内取最小的值
+        x = (hv + self.seed) * GOLDEN
+        x ^= x >> np.uint64(31)
+        bins = (x >> np.uint64(32)) % np.uint64(p)
+        vals = x & MAX_HASH
+
+        sig = np.full(n * p, MAX_HASH, dtype=np.uint64)
+        np.minimum.at(sig, np.repeat(np.arange(n, dtype=np.uint64), counts) * np.uint64(p) + bins, vals)
+        sig = sig.reshape(n, p)
+
+        # 空桶向右（循环）借最近的非空桶，并按距离加偏移，避免多个空桶取到完全相同的值
+        empty = sig == MAX_HASH
+        pos = np.where(empty, 3 * p, np.arange(p))
+        doubled = np.concatenate([pos, np.where(empty, 3 * p, pos + p)], axis=1)
+        nearest = np.minimum.accumulate(doubled[:, ::-1], axis=1)[:, ::-1][:, :p]
+        src = sig[np.arange(n)[:, None], nearest % p]
+        dist = (nearest - np.arange(p)).astype(np.uint64)
+        return ((src + dist * GOLDEN) & MAX_HASH).astype(np.uint32)
+
+    def buckets(self, sigs: np.ndarray) -> np.ndarray:
+        """每个 band 的 r 行签名混合成一个 64 位桶号，返回 (n, bands) 的 int64 矩阵"""
+        acc = np.zeros((len(sigs), self.bands), dtype=np.uint64)
+        bands = sigs[:, :self.bands * self.rows].reshape(len(sigs), self.bands, self.rows).astype(np.uint64)
+        for j in range(self.rows):
+            acc = acc * np.uint64(0x100000001B3) + bands[:, :, j] + np.uint64(1)
+        return acc.view(np.int64)
+
+    def _stored_candidates(self, band: int, buckets: list) -> dict:
+        placeholders = ','.join('?' * len(buckets))
+        found = {}
+        for bucket, doc_id in self.conn.execute(
+            f"SELECT bucket, doc_id FROM minhash_bands WHERE band = ? AND bucket IN ({placeholders})",
+            [band, *buckets]
+        ):
+            found.setdefault(bucket, []).append(doc_id)
+        return found
+
+    def _stored_sigs(self, doc_ids: set) -> dict:
+        if not doc_ids:
+            return {}
+        placeholders = ','.join('?' * len(doc_ids))
+        return {
+            doc_id: np.frombuffer(blob, dtype=np.uint32)
+            for doc_id, blob in self.conn.execute(
+                f"SELECT doc_id, sig FROM minhash_sigs WHERE doc_id IN ({placeholders})", list(doc_ids)
+            )
+        }
+
+    def filter(self, texts: list, doc_ids: list) -> np.ndarray:
+        """
+        返回保留掩码：与历史库或本批更早的记录 Jaccard ≥ threshold 的标为 False
+        保留下来的记录写入索引（调用方负责 commit）
+        """
+        n = len(texts)
+        keep = np.ones(n, dtype=bool)
+        has_text = np.array([bool(t) for t in texts], dtype=bool)
+        if not has_text.any():
+            return keep
+
+        rows = np.flatnonzero(has_text)
+        sigs = np.zeros((n, self.num_perm), dtype=np.uint32)
+        sigs[rows] = self.signatures([texts[i] for i in rows])
+        buckets = self.buckets(sigs).tolist()
+
+        # 每个 band 一条 SQL 批量取出历史库中的同桶候选
+        stored = [
+            self._stored_candidates(band, list({buckets[i][band] for i in rows}))
+            for band in range(self.bands)
+        ]
+        stored_ids = {doc_id for band in stored for ids in band.values() for doc_id in ids}
+        sig_of = self._stored_sigs(stored_ids)
+
+        batch_buckets = [{} for _ in range(self.bands)]
+        new_rows = []
+        for i in rows:
+            candidates = set()
+            for band, bucket in enumerate(buckets[i]):
+                candidates.update(stored[band].get(bucket, ()))
+                candidates.update(batch_buckets[band].get(bucket, ()))
+            # 同一 URL 的旧版本不算重复（增量爬虫只会重发内容变更过的通知）
+            candidates.discard(doc_ids[i])
+            if any(np.mean(sig_of[c] == sigs[i]) >= self.threshold for c in candidates):
+                keep[i] = False
+                continue
+
+            sig_of[doc_ids[i]] = sigs[i]
+            for band, bucket in enumerate(buckets[i]):
+                batch_buckets[band].setdefault(bucket, []).append(doc_ids[i])
+                new_rows.append((band, bucket, doc_ids[i]))
+
+        indexed = [i for i in rows if keep[i]]
+        # 同 URL 的旧版本：用旧签名算出旧桶号，按主键精确删除
+        old_sigs = self._stored_sigs({doc_ids[i] for i in indexed})
+        if old_sigs:
+            old_ids = list(old_sigs)
+            old_buckets = self.buckets(np.stack([old_sigs[d] for d in old_ids])).tolist()
+            self.conn.executemany(
+                "DELETE FROM minhash_bands WHERE band = ? AND bucket = ? AND doc_id = ?",
+                ((band, bucket, doc_id) for doc_id, row in zip(old_ids, old_buckets) for band, bucket in enumerate(row))
+            )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO minhash_sigs VALUES (?, ?)",
+            ((doc_ids[i], sigs[i].tobytes()) for i in indexed)
+        )
+        self.conn.executemany("INSERT OR IGNORE INTO minhash_bands VALUES (?, ?, ?)", new_rows)
+        return keep
+
+    def filter_df(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        对清洗后的块做近似去重：文本取 标题 + 正文，ID 取 url
+        没有正文的记录只有一行标题，"采购公告"/"结果公告"这类仅差两字的标题会被误判，跳过不比
+        """
+        has_content = df['content_clean'].str.len() > 0
+        texts = (df['title_clean'] + ' ' + df['content_clean']).where(has_content, '').tolist()
+        doc_ids = df['url'].astype(str).tolist() if 'url' in df else [str(i) for i in df.index]
+        return df[self.filter(texts, doc_ids)]
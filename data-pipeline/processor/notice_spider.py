@@ -1,7 +1,6 @@
 # crawler/notice_spider.py
 import requests
 from bs4 import BeautifulSoup
-import json
 from datetime import datetime
 import os
 from urllib.parse import urljoin
@@ -9,6 +8,8 @@ from urllib.parse import urljoin
 # 大学官网基础地址
 BASE_URL = "https://XXX/"
 NOTICE_URL = "https://XXX/newtzgg-list.jsp?urltype=tree.TreeTempUrl&wbtreeid=1187"
+# 分页列表地址，{page} 从 1 开始
+LIST_PAGE_URL = "https://www.nwu.edu.cn/newtzgg-list.jsp?urltype=tree.TreeTempUrl&wbtreeid=1187&PAGENUM={page}"
 
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
@@ -62,7 +63,7 @@ def crawl_notices():
         # 转换中文日期为标准格式
         publish_date = parse_chinese_date(raw_date)
 
-        # 初始化 content 字段（后续再抓）
+        # content 由详情页抓取阶段补全
         notices.append({
             "title": title,
             "url": url,
@@ -73,59 +74,103 @@ def crawl_notices():
             "content": ""
         })
 
-    # 保存原始数据
-    os.makedirs("data/raw", exist_ok=True)
-    filename = f"data/raw/notices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(notices, f, ensure_ascii=False, indent=2)
+    # 抓正文并流式保存原始数据
+    filename = save_with_details(notices, "notices")
 
     print(f"✅ 爬取完成，共 {len(notices)} 条通知，保存到 {filename}")
     return notices
 
 
+def parse_notice_list(html: str) -> list:
+    """
+    解析分页列表页，返回通知字典列表（content 留空，由详情页抓取补全）
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    notice_items = soup.select('div.nwu-not ul li')
+
+    notices = []
+    for item in notice_items:
+        month = item.select_one('time .month').get_text(strip=True)
+        day = item.select_one('time .day').get_text(strip=True)
+        raw_date = f"{month}{day}"
+
+        title_link = item.select_one('a')
+        title = title_link.get('title', '').strip()
+        href = title_link.get('href', '').strip()
+        url = urljoin(BASE_URL, href)
+
+        dept_span = item.select_one('.related-site a')
+        department = dept_span.get_text(strip=True) if dept_span else "未知"
+
+        publish_date = parse_chinese_date(raw_date)
+
+        notices.append({
+            "title": title,
+            "url": url,
+            "publish_date": publish_date,
+            "raw_date": raw_date,
+            "department": department,
+            "crawl_time": datetime.now().isoformat(),
+            "content": ""
+        })
+    return notices
+
+
+# 正文容器候选（按优先级），博达 VSB 站群为 v_news_content
+CONTENT_SELECTORS = ['div.v_news_content', '#vsb_content', 'div.article-content', 'div.content', 'article']
+
+
+def extract_content(html: str) -> str:
+    """
+    从详情页提取正文文本
+    先按已知正文容器匹配，匹配不到时取直接子段落文字最多的 div 兜底
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(['script', 'style', 'noscript']):
+        tag.decompose()
+
+    body = None
+    for selector in CONTENT_SELECTORS:
+        body = soup.select_one(selector)
+        if body and body.get_text(strip=True):
+            break
+    else:
+        body = max(
+            soup.find_all('div'),
+            key=lambda d: sum(len(p.get_text(strip=True)) for p in d.find_all('p', recursive=False)),
+            default=None
+        )
+    return body.get_text('\n', strip=True) if body else ""
+
+
+def save_with_details(notices: list, prefix: str) -> str:
+    """
+    并发抓取详情页正文，每抓完一条就追加写入 data/raw/{prefix}_时间戳.jsonl
+    """
+    from processor.async_spider import stream_details  # 避免循环导入
+
+    os.makedirs("data/raw", exist_ok=True)
+    filename = f"data/raw/{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    stream_details(notices, filename)
+    return filename
+
+
 def crawl_all_notices(max_pages=5):  # 先爬5页做测试
     all_notices = []
     for page in range(1, max_pages + 1):
         print(f"正在爬取第 {page} 页...")
-        page_url = f"https://www.nwu.edu.cn/newtzgg-list.jsp?urltype=tree.TreeTempUrl&wbtreeid=1187&PAGENUM={page}"
+        page_url = LIST_PAGE_URL.format(page=page)
         response = requests.get(page_url, headers=HEADERS)
         response.raise_for_status()
         response.encoding = 'utf-8'
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-        notice_items = soup.select('div.nwu-not ul li')
-
-        for item in notice_items:
-            month = item.select_one('time .month').get_text(strip=True)
-            day = item.select_one('time .day').get_text(strip=True)
-            raw_date = f"{month}{day}"
+        all_notices.extend(parse_notice_list(response.text))
 
-            title_link = item.select_one('a')
-            title = title_link.get('title', '').strip()
-            href = title_link.get('href', '').strip()
-            url = urljoin(BASE_URL, href)
-
-            dept_span = item.select_one('.related-site a')
-            department = dept_span.get_text(strip=True) if dept_span else "未知"
-
-            publish_date = parse_chinese_date(raw_date)
-
-            all_notices.append({
-                "title": title,
-                "url": url,
-                "publish_date": publish_date,
-                "raw_date": raw_date,
-                "department": department,
-                "crawl_time": datetime.now().isoformat(),
-                "content": ""
-            })
-
-    # 保存
-    os.makedirs("./data/raw", exist_ok=True)
-    filename = f"./data/raw/notices_all_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(all_notices, f, ensure_ascii=False, indent=2)
+    # 抓正文并流式保存
+    filename = save_with_details(all_notices, "notices_all")
 
     print(f"所有通知爬取完成，共 {len(all_notices)} 条，保存到 {filename}")
+    return all_notices
+
 if __name__ == '__main__':
     crawl_all_notices(max_pages=3)  # 先爬3页试试
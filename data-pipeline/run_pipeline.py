@@ -1,28 +1,73 @@
 # scripts/run_pipeline.py
-from processor.notice_spider import crawl_notices
-from processor.clean_dedup import load_and_clean
+from processor.async_spider import run_incremental_crawl
+from processor.clean_dedup import load_and_clean, mark_ingested, pending_clean_files, RAW_DIR
 from vector_store import store_to_vector_db
 from import_to_ls import import_to_label_studio
-import time
+from pipeline_graph import Stage, PipelineRunner
+import sys
+
+
+def crawl_stage(results):
+    # 增量爬取：只抓新增/变更的通知
+    raw_file = run_incremental_crawl()
+    items = 0
+    if raw_file:
+        with open(raw_file, encoding='utf-8') as f:
+            items = sum(1 for _ in f)
+    return {"items": items, "file": raw_file}
+
+
+def clean_stage(results):
+    # 清洗：只处理未清洗过的原始文件
+    cleaned_count, cleaned_file = load_and_clean()
+    return {"items": cleaned_count, "file": cleaned_file}
+
+
+def _ingest_pending(sink, ingest):
+    # 处理该下游所有未处理过的清洗输出，而不只是本次清洗的文件：
+    # 上次运行清洗已提交（清单、去重键）但下游失败时，那批通知留在旧文件里，这里补上；
+    # 每个文件成功后立即登记，中途失败的文件下次整份重跑（向量库按内容哈希、标注按台账，重复处理是幂等的）
+    items = 0
+    for clean_file in pending_clean_files(sink):
+        items += ingest(clean_file)
+        mark_ingested(sink, clean_file)
+    return {"items": items}
 
-def run_pipeline():
-    print("🚀 开始执行通知公告爬取流程...")
-    try:
-        # 1. 爬取
-        crawl_notices()
 
-        # 2. 清洗
-        cleaned_data, cleaned_file = load_and_clean()
+def vector_stage(results):
+    return _ingest_pending("vector_store", store_to_vector_db)
 
-        # 3. 向量化入库
-        store_to_vector_db(cleaned_file)
 
-        # 4. 导入标注系统
-        import_to_label_studio(cleaned_file)
+def label_studio_stage(results):
+    return _ingest_pending("label_studio", import_to_label_studio)
 
-        print("🎉 全流程执行完毕！")
-    except Exception as e:
-        print(f"❌ 流程出错: {e}")
+
+def pending_for(sink):
+    return lambda results: pending_clean_files(sink) or None
+
+
+STAGES = [
+    Stage("crawl", crawl_stage, always_run=True),
+    Stage("clean", clean_stage, deps=["crawl"], inputs=[RAW_DIR]),
+    # 向量入库与标注导入互不依赖，并发执行
+    Stage("vector_store", vector_stage, deps=["clean"], inputs=pending_for("vector_store")),
+    Stage("label_studio", label_studio_stage, deps=["clean"], inputs=pending_for("label_studio")),
+]
+
+
+def run_pipeline(streaming=False):
+    if streaming:
+        # 进程内流式：各阶段逐批交接，新通知爬到后几秒内即可检索
+        from streaming_pipeline import run_pipeline_streaming
+        return run_pipeline_streaming()
+    print("🚀 开始执行通知公告爬取流程...")
+    report = PipelineRunner(STAGES).run()
+    if report["status"] == "success":
+        print(f"🎉 全流程执行完毕！耗时 {report['wall_time_s']}s")
+    else:
+        print("❌ 流程出错，详见运行报告")
+    return report
 
 if __name__ == '__main__':
-    run_pipeline()
\ No newline at end of file
+    report = run_pipeline(streaming='--stream' in sys.argv[1:])
+    sys.exit(0 if report["status"] == "success" else 1)
@@ -0,0 +1,118 @@
+# search/search.py
+"""
+school_notices 集合的语义检索
+常驻一个 ChromaDB 客户端和共享向量模型；查询向量走 LRU 缓存，热点结果走 LRU + TTL 缓存
+每次入库都会更新 vectordb/.generation，检测到变化即清空结果缓存
+"""
+import threading
+from datetime import date, datetime
+
+import numpy as np
+from cachetools import LRUCache, TTLCache
+
+from processor.embedding import encode
+from vector_store import VECTOR_DB_PATH, get_collection, publish_day, read_generation
+
+
+def _filter_day(value) -> int:
+    """过滤条件里的日期必须能解析，不能像入库数据那样退化成 0（否则 date_from 被忽略、date_to 查不到任何结果）"""
+    if not isinstance(value, date):
+        try:
+            value = datetime.strptime(str(value), "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError(f"invalid date filter {value!r}, expected YYYY-MM-DD")
+    return publish_day(value.isoformat())
+
+
+def build_where(date_from=None, date_to=None, department=None):
+    """日期范围（YYYY-MM-DD，含边界）与部门过滤 → Chroma where 条件；日期格式不对抛 ValueError"""
+    conditions = []
+    if date_from:
+        conditions.append({"publish_day": {"$gte": _filter_day(date_from)}})
+    if date_to:
+        conditions.append({"publish_day": {"$lte": _filter_day(date_to)}})
+    if department:
+        conditions.append({"department": department})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class NoticeSearcher:
+    def __init__(self, path=VECTOR_DB_PATH, result_cache_size=2048, result_ttl=300, query_cache_size=8192):
+        self.path = path
+        self.client, self.collection = get_collection(path)
+        self.query_cache = LRUCache(maxsize=query_cache_size)   # 查询文本 → 向量，模型不变就一直有效
+        self.result_cache = TTLCache(maxsize=result_cache_size, ttl=result_ttl)
+        self._generation = read_generation(path)
+        self._lock = threading.Lock()  # cachetools 不是线程安全的
+
+    def warm_up(self):
+        """提前加载模型，避免第一个请求承担加载耗时"""
+        self.embed(["预热"])
+
+    def _check_generation(self):
+        generation = read_generation(self.path)
+        if generation != self._generation:
+            with self._lock:
+                self.result_cache.clear()
+                self._generation = generation
+
+    def embed(self, queries: list) -> np.ndarray:
+        with self._lock:
+            cached = {q: self.query_cache.get(q) for q in queries}
+        missing = list(dict.fromkeys(q for q, v in cached.items() if v is None))
+        if missing:
+            vectors = encode(missing)
+            with self._lock:
+                for q, v in zip(missing, vectors):
+                    self.query_cache[q] = v
+                    cached[q] = v
+        return np.stack([cached[q] for q in queries])
+
+    def search_many(self, queries: list, k=5, date_from=None, date_to=None, department=None) -> list:
+        """
+        批量检索：缓存未命中的查询合并成一次编码、一次 collection.query
+        返回与 queries 一一对应的结果列表
+        """
+        self._check_generation()
+        filters = (k, date_from, date_to, department)
+        with self._lock:
+            results = {q: self.result_cache.get((q, filters)) for q in queries}
+        missing = list(dict.fromkeys(q for q, r in results.items() if r is None))
+
+        if missing:
+            raw = self.collection.query(
+                query_embeddings=self.embed(missing),
+                n_results=k,
+                where=build_where(date_from, date_to, department),
+                include=["metadatas", "distances", "documents"]
+            )
+            with self._lock:
+                for i, q in enumerate(missing):
+                    hits = [
+                        {
+                            "id": doc_id,
+                            "title": meta.get("title"),
+                            "url": meta.get("url"),
+                            "publish_date": meta.get("publish_date"),
+                            "department": meta.get("department"),
+                            "distance": dist,
+                            "snippet": (doc or "")[:200]
+                        }
+                        for doc_id, meta, dist, doc in zip(
+                            raw["ids"][i], raw["metadatas"][i], raw["distances"][i], raw["documents"][i]
+                        )
+                    ]
+                    self.result_cache[(q, filters)] = hits
+                    results[q] = hits
+        return [results[q] for q in queries]
+
+    def search(self, query: str, k=5, date_from=None, date_to=None, department=None) -> list:
+        return self.search_many([query], k, date_from, date_to, department)[0]
+
+
+if __name__ == '__main__':
+    searcher = NoticeSearcher()
+    for hit in searcher.search("国庆节放假安排", k=3):
+        print(hit["publish_date"], hit["title"], hit["url"])
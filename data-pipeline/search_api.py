@@ -0,0 +1,59 @@
+# search/search_api.py
+"""
+语义检索 HTTP 服务
+uvicorn search_api:app --host 0.0.0.0 --port 8100
+"""
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import List, Optional
+
+from fastapi import FastAPI, Query
+from pydantic import BaseModel, Field
+
+from search import NoticeSearcher
+
+searcher: Optional[NoticeSearcher] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global searcher
+    searcher = NoticeSearcher()
+    searcher.warm_up()
+    yield
+
+
+app = FastAPI(title="School Notice Search", lifespan=lifespan)
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    k: int = Field(5, ge=1, le=100)
+    date_from: Optional[date] = None   # YYYY-MM-DD，格式不对直接 422
+    date_to: Optional[date] = None
+    department: Optional[str] = None
+
+
+# 编码和查询都是阻塞调用，用普通 def，由 FastAPI 放到线程池执行
+@app.get("/search")
+def search(
+    q: str,
+    k: int = Query(5, ge=1, le=100),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    department: Optional[str] = None
+):
+    return {"query": q, "results": searcher.search(q, k, date_from, date_to, department)}
+
+
+@app.post("/search/batch")
+def search_batch(request: BatchSearchRequest):
+    results = searcher.search_many(
+        request.queries, request.k, request.date_from, request.date_to, request.department
+    )
+    return {"results": [{"query": q, "results": r} for q, r in zip(request.queries, results)]}
+
+
+@app.get("/health")
+def health():
+    return {"status": "healthy", "count": searcher.collection.count()}
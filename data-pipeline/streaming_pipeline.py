@@ -0,0 +1,262 @@
+# scripts/streaming_pipeline.py
+"""
+进程内流式管道：爬取 → 清洗 → 去重 → (向量入库 ∥ 标注导入)
+各阶段各占一个线程，通过有界队列逐批传递通知，不再经过整文件 JSON 往返
+队列满时上游阻塞（背压），内存只与 队列长度 × 批大小 有关；文件只作为可选检查点
+"""
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from import_to_ls import Ledger, import_chunk, sync_ledger_from_project
+from pipeline_graph import REPORT_DIR
+from processor.async_spider import crawl_incremental_async
+from processor.clean_dedup import (
+    CLEAN_DIR, DEDUP_DB_PATH, NEAR_DUP_THRESHOLD, RAW_DIR, clean_chunk, drop_seen, mark_cleaned,
+    mark_ingested
+)
+from processor.crawl_index import CrawlIndex
+from processor.embedding_cache import EmbeddingCache
+from processor.jsonl import JsonlWriter
+from processor.near_dedup import NearDupIndex
+from vector_store import get_collection, ingest_chunk
+
+STREAM_BATCH_SIZE = 64   # 阶段间每批通知条数
+QUEUE_MAXSIZE = 8        # 每个队列最多缓冲的批数
+_END = object()          # 流结束标记
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_s = 0.0
+        self.first_output_at = None
+        self.error = None
+
+    def as_dict(self):
+        return {k: v for k, v in vars(self).items()}
+
+
+def _record_error(stats, e):
+    stats.error = repr(e)
+    print(f"❌ [{stats.name}] 出错: {e}")
+
+
+def _worker(stats, inbox, outboxes, handle):
+    """
+    通用阶段线程：从 inbox 取批 → handle(batch) → 结果放入所有 outboxes
+    出错后记录异常并继续消费（丢弃）上游数据，避免上游在满队列上永久阻塞
+    阶段初始化失败时先记录 stats.error 再调用，这里只负责排空 inbox 并向下游转发结束标记
+    """
+    while True:
+        batch = inbox.get()
+        if batch is _END:
+            break
+        if stats.error is not None:
+            continue
+        start = time.perf_counter()
+        try:
+            out = handle(batch)
+        except Exception as e:
+            _record_error(stats, e)
+            continue
+        stats.busy_s += time.perf_counter() - start
+        stats.batches += 1
+        stats.items_in += len(batch)
+        stats.items_out += out if isinstance(out, int) else len(out)
+        if stats.first_output_at is None and out:
+            stats.first_output_at = time.time()
+        for box in outboxes:
+            box.put(out)
+    for box in outboxes:
+        box.put(_END)
+
+
+def run_pipeline_streaming(max_pages=50, batch_size=STREAM_BATCH_SIZE, checkpoint=True,
+                           near_dup_threshold=NEAR_DUP_THRESHOLD):
+    print("🚀 流式执行通知公告流程...")
+    start = time.time()
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    raw_q, embed_q, ls_q = (queue.Queue(QUEUE_MAXSIZE) for _ in range(3))
+    crawl_stats, clean_stats, embed_stats, ls_stats = (
+        StageStats(n) for n in ("crawl", "clean", "vector_store", "label_studio")
+    )
+
+    # ---- 爬取：在本线程的事件循环里运行，攒够一批就放入队列 ----
+    raw_file = f"{RAW_DIR}/notices_{stamp}.jsonl" if checkpoint else None
+
+    def crawl():
+        index = writer = None
+        buffer = []
+
+        async def sink(notice):
+            if writer:
+                writer.write(notice)
+            crawl_stats.items_out += 1
+            buffer.append(notice)
+            if len(buffer) >= batch_size:
+                batch = buffer.copy()
+                buffer.clear()
+                crawl_stats.batches += 1
+                # 下游处理不过来时队列满，put 在线程池里等待：只有交付这一批的协程挂起（背压），
+                # 事件循环不被阻塞，其他进行中的 HTTP 请求照常完成
+                await asyncio.get_running_loop().run_in_executor(None, raw_q.put, batch)
+
+        try:
+            os.makedirs(RAW_DIR, exist_ok=True)
+            index = CrawlIndex()
+            writer = JsonlWriter(raw_file) if raw_file else None
+            asyncio.run(crawl_incremental_async(index, sink, max_pages, commit=False))
+        except Exception as e:
+            _record_error(crawl_stats, e)
+        finally:
+            if writer:
+                writer.close()
+            # 事件循环已结束，这里阻塞等待队列空位不影响任何请求
+            if buffer:
+                raw_q.put(buffer)
+                crawl_stats.batches += 1
+            raw_q.put(_END)
+        if index is None:
+            return
+        # 抓取进度（索引）要等下游确认：清洗线程在向量入库和标注导入都结束后才退出，
+        # 全部成功、去重键已提交才提交索引，否则回滚，这些通知下次运行会重新抓取
+        threads["clean"].join()
+        try:
+            if outcome["committed"] and crawl_stats.error is None:
+                index.commit()
+            else:
+                index.rollback()
+                print("⚠️ 有阶段出错，抓取索引已回滚")
+        finally:
+            index.close()
+
+    # ---- 清洗 + 精确去重 + 近似去重 ----
+    clean_file = f"{CLEAN_DIR}/notices_clean_{stamp}.jsonl" if checkpoint else None
+    outcome = {"committed": False}
+
+    def clean():
+        conn = near_index = writer = None
+        try:
+            os.makedirs(CLEAN_DIR, exist_ok=True)
+            conn = sqlite3.connect(DEDUP_DB_PATH)  # SQLite 连接只能在创建它的线程里用
+            conn.execute("CREATE TABLE IF NOT EXISTS dedup_keys (key TEXT PRIMARY KEY)")
+            near_index = NearDupIndex(conn, threshold=near_dup_threshold) if near_dup_threshold else None
+            conn.commit()  # 只提交建表；去重键在下游全部成功后才提交
+            writer = JsonlWriter(clean_file) if clean_file else None
+        except Exception as e:
+            _record_error(clean_stats, e)
+
+        def handle(batch):
+            df = drop_seen(clean_chunk(pd.DataFrame.from_records(batch)), conn)
+            if near_index is not None and not df.empty:
+                df = near_index.filter_df(df)
+            records = df.astype(object).where(df.notna(), None).to_dict('records')
+            if writer:
+                for r in records:
+                    writer.write(r)
+            return records
+
+        try:
+            _worker(clean_stats, raw_q, [embed_q, ls_q], handle)
+            # 去重键（含近似去重索引）等向量入库和标注导入都结束后再决定：
+            # 全部成功才提交，否则回滚，这批通知下次运行（流式或批处理）还会被处理，不会因为已去重而丢失
+            for name in ("embed", "label_studio"):
+                threads[name].join()
+            if all(s.error is None for s in (clean_stats, embed_stats, ls_stats)):
+                conn.commit()
+                outcome["committed"] = True
+            elif conn is not None:
+                conn.rollback()
+                print("⚠️ 有阶段出错，去重键已回滚")
+        finally:
+            if conn is not None:
+                conn.close()
+            if writer:
+                writer.close()
+
+    # ---- 向量入库 ----
+    # 各阶段的初始化也可能失败（打不开数据库、连不上服务），失败时仍要进入 _worker 排空队列，否则上游会永久阻塞
+    def embed():
+        collection = cache = None
+        try:
+            _, collection = get_collection()
+            cache = EmbeddingCache()
+        except Exception as e:
+            _record_error(embed_stats, e)
+        try:
+            _worker(embed_stats, embed_q, [], lambda batch: ingest_chunk(collection, batch, cache) if batch else 0)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    # ---- 导入 Label Studio ----
+    def label_studio():
+        ledger = None
+        try:
+            ledger = Ledger()
+            if ledger.is_empty():
+                sync_ledger_from_project(ledger)
+        except Exception as e:
+            _record_error(ls_stats, e)
+        try:
+            _worker(ls_stats, ls_q, [], lambda batch: import_chunk(batch, ledger) if batch else 0)
+        finally:
+            if ledger is not None:
+                ledger.close()
+
+    threads = {f.__name__: threading.Thread(target=f, name=f.__name__) for f in (crawl, clean, embed, label_studio)}
+    for t in threads.values():
+        t.start()
+    for t in threads.values():
+        t.join()
+
+    # 检查点文件已在流中完整处理过（下游全部成功、去重键已提交）才登记到清单，批处理模式不会再处理一遍；
+    # 否则不登记，留给下次批处理重新清洗入库
+    if raw_file and os.path.exists(raw_file):
+        if crawl_stats.items_out and outcome["committed"]:
+            mark_cleaned(os.path.basename(raw_file), crawl_stats.items_out, clean_stats.items_out, clean_file)
+            if clean_file and os.path.exists(clean_file) and clean_stats.items_out:
+                for sink in ("vector_store", "label_studio"):
+                    mark_ingested(sink, clean_file)
+        elif not crawl_stats.items_out:
+            os.remove(raw_file)
+            raw_file = None
+    # 去重键未提交的清洗检查点不留：原始检查点会被批处理重新清洗，否则下游会把这份当作待处理输出再导入一遍
+    if clean_file and os.path.exists(clean_file) and (not clean_stats.items_out or not outcome["committed"]):
+        os.remove(clean_file)
+        clean_file = None
+
+    stats = [s.as_dict() for s in (crawl_stats, clean_stats, embed_stats, ls_stats)]
+    for s in stats:
+        lag = f"，首批产出 +{s['first_output_at'] - start:.1f}s" if s['first_output_at'] else ""
+        print(f"  [{s['name']}] 入 {s['items_in']} 出 {s['items_out']}，忙碌 {s['busy_s']:.1f}s{lag}"
+              + (f"，错误 {s['error']}" if s['error'] else ""))
+    failed = any(s['error'] for s in stats)
+    report = {
+        "run_at": datetime.now().isoformat(),
+        "mode": "streaming",
+        "status": "failed" if failed else "success",
+        "wall_time_s": round(time.time() - start, 3),
+        "checkpoints": {"raw": raw_file, "clean": clean_file},
+        "stages": stats,
+    }
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    with open(os.path.join(REPORT_DIR, f"stream_{stamp}.json"), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(("❌ 流式流程有阶段出错" if failed else "🎉 流式流程执行完毕！") + f" 耗时 {report['wall_time_s']}s")
+    return report
+
+
+if __name__ == '__main__':
+    run_pipeline_streaming()
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# 各脚本按 data-pipeline 目录下运行的方式导入（from processor... / import vector_store）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
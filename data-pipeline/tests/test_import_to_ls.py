@@ -0,0 +1,65 @@
+# tests/test_import_to_ls.py
+"""用桩项目（替代 Label Studio 客户端）验证分块导入的去重与台账"""
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("label_studio_sdk")
+import import_to_ls  # noqa: E402
+
+
+class StubProject:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.uploaded = []
+        self._lock = threading.Lock()
+
+    def get_tasks(self):
+        return []
+
+    def import_tasks(self, tasks):
+        time.sleep(0.02)  # 让多块同时在途
+        if self.fail:
+            raise ConnectionError("label studio down")
+        with self._lock:
+            self.uploaded.extend(tasks)
+
+
+@pytest.fixture
+def cleaned_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # 台账写在 tmp_path/data 下
+    monkeypatch.setattr(import_to_ls, "IMPORT_RETRIES", 0)
+    # 每条通知出现两次，且落在不同的块里
+    notices = [{"title": f"通知{i}", "content": f"内容{i}", "url": f"https://example.edu/{i}"} for i in range(10)]
+    path = tmp_path / "notices_clean.jsonl"
+    path.write_text("\n".join(json.dumps(n, ensure_ascii=False) for n in notices * 2) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def use_project(monkeypatch, project):
+    monkeypatch.setattr(import_to_ls, "_project", project)
+
+
+def test_duplicates_in_parallel_chunks_upload_once(cleaned_file, monkeypatch):
+    project = StubProject()
+    use_project(monkeypatch, project)
+
+    assert import_to_ls.import_to_label_studio(cleaned_file, chunk_size=3, parallel=4) == 10
+    assert sorted(t["data"]["url"] for t in project.uploaded) == sorted(f"https://example.edu/{i}" for i in range(10))
+
+    # 第二次运行全部命中台账，不再上传
+    assert import_to_ls.import_to_label_studio(cleaned_file, chunk_size=3, parallel=4) == 0
+    assert len(project.uploaded) == 10
+
+
+def test_failed_chunks_are_not_recorded(cleaned_file, monkeypatch):
+    use_project(monkeypatch, StubProject(fail=True))
+    with pytest.raises(RuntimeError):
+        import_to_ls.import_to_label_studio(cleaned_file, chunk_size=3, parallel=2)
+
+    project = StubProject()
+    use_project(monkeypatch, project)
+    assert import_to_ls.import_to_label_studio(cleaned_file, chunk_size=3, parallel=2) == 10
+    assert len(project.uploaded) == 10
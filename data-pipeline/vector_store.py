@@ -1,37 +1,165 @@
 # vector_db/vector_store.py
 import chromadb
-import json
-from processor.clean_dedup import model  # 复用模型
-from chromadb.utils import embedding_functions
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from chromadb.api.types import EmbeddingFunction
+from processor.embedding import MODEL_NAME, DEVICE, encode
+from processor.embedding_cache import EmbeddingCache
+from processor.jsonl import iter_records, iter_chunks
 
-def store_to_vector_db(cleaned_file):
-    client = chromadb.PersistentClient(path="./vectordb")
+VECTOR_DB_PATH = "./vectordb"
+COLLECTION_NAME = "school_notices"
+INGEST_CHUNK_SIZE = 512   # 每块编码/写入的条数，决定入库时的内存上限
+GENERATION_FILE = ".generation"   # 每次入库后更新，查询端据此让结果缓存失效
+
+
+class SharedEmbeddingFunction(EmbeddingFunction):
+    """
+    ChromaDB 的向量函数，复用 processor.embedding 的进程内单例模型
+    name / config 与 chroma 自带的 SentenceTransformerEmbeddingFunction 保持一致，已有的集合可直接打开
+    """
+
+    def __init__(self):
+        pass
+
+    def __call__(self, input):
+        return encode(list(input))
+
+    @staticmethod
+    def name():
+        return "sentence_transformer"
+
+    def default_space(self):
+        return "cosine"
+
+    def get_config(self):
+        return {"model_name": MODEL_NAME, "device": DEVICE or "cpu", "normalize_embeddings": False, "kwargs": {}}
+
+    @staticmethod
+    def build_from_config(config):
+        return SharedEmbeddingFunction()
+
+
+def notice_id(item):
+    return f"notice_{item.get('url', '').split('/')[-1].replace('.html','')}"
+
+def notice_text(item):
+    # 没抓到正文的旧数据退回用标题，避免大量空串向量
+    return item.get('content_clean') or item.get('title_clean') or item.get('title', '')
+
+def publish_day(publish_date):
+    """'2025-10-22' → 20251022，Chroma 的 $gte/$lte 只支持数值，日期范围过滤用它；未知日期记 0"""
+    digits = str(publish_date).replace('-', '')
+    return int(digits) if digits.isdigit() and len(digits) == 8 else 0
+
+def bump_generation(path=VECTOR_DB_PATH):
+    with open(os.path.join(path, GENERATION_FILE), 'w') as f:
+        f.write(str(time.time_ns()))
+
+def read_generation(path=VECTOR_DB_PATH):
+    try:
+        with open(os.path.join(path, GENERATION_FILE)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
+
+def get_collection(path=VECTOR_DB_PATH):
+    client = chromadb.PersistentClient(path=path)
     collection = client.get_or_create_collection(
-        name="school_notices",
-        embedding_function=embedding_functions.SentenceTransformerEmbeddingFunction("all-MiniLM-L6-v2")
+        name=COLLECTION_NAME,
+        embedding_function=SharedEmbeddingFunction()
     )
+    return client, collection
+
+def prepare_chunk(collection, records, cache):
+    """
+    一块记录 → 待写入的 upsert 参数；库里已有、内容哈希相同且由当前模型编码的跳过，只编码新增/变更
+    没有需要写入的记录时返回 None
+    """
+    # 同一 ID 出现多次时以最后一条（最新版本）为准
+    data = list({notice_id(item): item for item in records}.values())
+    ids = [notice_id(item) for item in data]
+    texts = [notice_text(item) for item in data]
+    hashes = [hashlib.sha256(t.encode('utf-8')).hexdigest() for t in texts]
 
-    with open(cleaned_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    texts = [item['content_clean'] for item in data]
-    embeddings = model.encode(texts, show_progress_bar=False)
-
-    ids = [f"notice_{item.get('url', '').split('/')[-1].replace('.html','')}" for item in data]
-    metadatas = [{
-        "title": item['title'],
-        "url": item['url'],
-        "publish_date": item['publish_date'],
-        "crawl_time": item['crawl_time']
-    } for item in data]
-
-    collection.add(
-        embeddings=embeddings.tolist(),
-        documents=texts,
-        metadatas=metadatas,
-        ids=ids
+    existing = collection.get(ids=ids, include=['metadatas'])
+    # 换了嵌入模型后旧向量不可比，即使文本没变也要重新编码
+    stored = {
+        i: ((m or {}).get('content_hash'), (m or {}).get('embedding_model'))
+        for i, m in zip(existing['ids'], existing['metadatas'])
+    }
+    todo = [k for k, i in enumerate(ids) if stored.get(i) != (hashes[k], MODEL_NAME)]
+    if not todo:
+        return None
+
+    return dict(
+        ids=[ids[k] for k in todo],
+        embeddings=cache.encode([texts[k] for k in todo]),  # 直接传 numpy，不再 tolist()
+        documents=[texts[k] for k in todo],
+        metadatas=[{
+            "title": data[k]['title'],
+            "url": data[k]['url'],
+            "publish_date": data[k]['publish_date'],
+            "publish_day": publish_day(data[k]['publish_date']),
+            "department": data[k].get('department') or "未知",
+            "crawl_time": data[k]['crawl_time'],
+            "content_hash": hashes[k],
+            "embedding_model": MODEL_NAME
+        } for k in todo]
     )
-    print(f"✅ 已向量化并存入 ChromaDB，共 {len(data)} 条")
+
+def ingest_chunk(collection, records, cache):
+    """同步处理一块记录，返回写入条数（流式管道逐批调用）"""
+    payload = prepare_chunk(collection, records, cache)
+    if payload is None:
+        return 0
+    collection.upsert(**payload)
+    bump_generation()
+    return len(payload['ids'])
+
+def store_to_vector_db(cleaned_file, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    分块流式入库：读一块 → 编码 → 写入，内存只与 chunk_size 有关
+    写入放在后台线程，与下一块的编码重叠执行
+    """
+    client, collection = get_collection()
+    chunk_size = min(chunk_size, client.get_max_batch_size())
+    cache = EmbeddingCache()
+
+    start = time.perf_counter()
+    seen = written = 0
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        pending = None
+        for records in iter_chunks(iter_records(cleaned_file), chunk_size):
+            payload = prepare_chunk(collection, records, cache)
+            seen += len(records)
+            # 同一时刻只有一块在写，保证写入顺序且内存里最多两块
+            if pending is not None:
+                pending.result()
+            if payload is not None:
+                pending = writer.submit(collection.upsert, **payload)
+                written += len(payload['ids'])
+            else:
+                pending = None
+            elapsed = time.perf_counter() - start
+            print(f"  已处理 {seen} 条，写入 {written} 条，{seen / elapsed:.1f} 条/秒")
+        if pending is not None:
+            pending.result()
+    cache.close()
+    if written:
+        bump_generation()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ 入库完成：处理 {seen} 条，新增/变更 {written} 条，跳过未变化 {seen - written} 条，"
+          f"耗时 {elapsed:.1f}s（{seen / max(elapsed, 1e-9):.1f} 条/秒）")
+    return written
 
 if __name__ == '__main__':
-    store_to_vector_db(cleaned_file='./processor/data/cleaned/notices_clean_latest.json')
\ No newline at end of file
+    from processor.clean_dedup import latest_clean_file
+    cleaned_file = latest_clean_file()
+    if cleaned_file:
+        store_to_vector_db(cleaned_file=cleaned_file)
+    else:
+        print("❌ 没有清洗后的数据文件，请先运行清洗")
@@ -1,99 +1,262 @@
 # app.py
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import Response
 from prometheus_client import (
-    start_http_server,
     Histogram,
     Counter,
+    Gauge,
     generate_latest,
     CONTENT_TYPE_LATEST
 )
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import os
+import random
+import re
+import sys
 import time
-import threading
 import uvicorn
 
-app = FastAPI()
+# 并发控制 / 响应缓存与 deploy/app.py 共用 deploy/serving.py（镜像里 serving.py 与 app.py 放在同一目录）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from serving import (  # noqa: E402
+    CACHE_SIZE, CACHE_TTL, MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT, ConcurrencyLimiter, ResponseCache,
+    SlotStreamingResponse,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    lag_task = asyncio.create_task(monitor_event_loop_lag())
+    yield
+    lag_task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+TOKEN_INTERVAL = float(os.getenv("TOKEN_INTERVAL", "0.02"))  # 模拟的每 token 生成间隔（秒）
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT)
+response_cache = ResponseCache(CACHE_SIZE, CACHE_TTL)
+SAMPLING_PARAMS = ("model", "max_tokens", "temperature", "top_p", "top_k", "n", "stop", "seed")
 
 # ======================================
 # 1. 定义你要监控的指标
 # ======================================
+# 所有指标都带 model_version（v1 / v2，由 Helm deployment 的 MODEL_VERSION 注入），Grafana 直接对比金丝雀和稳定版
+MODEL_VERSION = os.getenv("MODEL_VERSION", "unknown")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # 事件循环延迟采样间隔（秒）
 
-# 请求延迟（histogram）
+# 请求延迟（histogram），由中间件统一记录，包括 4xx / 5xx
 REQUEST_LATENCY = Histogram(
     'vllm_request_latency_seconds',
-    'Time spent processing request'
+    'Time spent processing request',
+    ['method', 'route', 'status', 'model_version'],
+    buckets=[0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0]
 )
 
-# 请求总数（counter），按状态码分类
+# 请求总数（counter），按路由 + 状态码分类
 REQUESTS_TOTAL = Counter(
     'vllm_requests_total',
     'Total requests',
-    ['method', 'endpoint', 'status']
+    ['method', 'route', 'status', 'model_version']
 )
 
+# 正在处理的 HTTP 请求数（含排队中的）
+REQUESTS_IN_FLIGHT = Gauge(
+    'vllm_requests_in_flight',
+    'HTTP requests currently being processed',
+    ['model_version']
+).labels(MODEL_VERSION)
+
+# 等待推理名额的请求数，抓取时直接读限流器
+QUEUE_DEPTH = Gauge(
+    'vllm_queue_depth',
+    'Requests waiting for an inference slot',
+    ['model_version']
+).labels(MODEL_VERSION)
+QUEUE_DEPTH.set_function(lambda: limiter.waiting)
+
+# 事件循环延迟：sleep 实际醒来比预期晚多少，阻塞了事件循环的代码会让它升高
+EVENT_LOOP_LAG = Histogram(
+    'vllm_event_loop_lag_seconds',
+    'Delay between scheduled and actual wake-up of the event loop',
+    ['model_version'],
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+).labels(MODEL_VERSION)
+
 # Token 延迟（可选）
 TOKEN_LATENCY = Histogram(
     'vllm_token_latency_seconds',
-    'Latency per token generated'
-)
+    'Latency per token generated',
+    ['model_version']
+).labels(MODEL_VERSION)
+
+# 首 token 延迟（TTFT，从收到请求算起，包含排队）：用户感知到的响应速度
+TIME_TO_FIRST_TOKEN = Histogram(
+    'vllm_time_to_first_token_seconds',
+    'Time from request arrival to first generated token',
+    ['model_version'],
+    buckets=[0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0]
+).labels(MODEL_VERSION)
+
+# 相邻两个 token 的间隔（ITL）：流式输出是否卡顿
+INTER_TOKEN_LATENCY = Histogram(
+    'vllm_inter_token_latency_seconds',
+    'Latency between consecutive generated tokens',
+    ['model_version'],
+    buckets=[0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0]
+).labels(MODEL_VERSION)
 
-# GPU 利用率（模拟）
-GPU_UTIL = Histogram(
-    'vllm_gpu_utilization',
-    'GPU utilization',
-    buckets=[0.1, 0.3, 0.5, 0.7, 0.9, 1.0]
+# 单个请求的生成吞吐（token/s，从首 token 之前的 prefill 开始算）
+TOKENS_PER_SECOND = Histogram(
+    'vllm_tokens_per_second',
+    'Generated tokens per second per request',
+    ['model_version'],
+    buckets=[1, 5, 10, 25, 50, 100, 200, 500]
+).labels(MODEL_VERSION)
+
+# 响应缓存命中 / 未命中；source=hit 为缓存直接返回，coalesced 为合并到正在进行的相同请求
+CACHE_HITS = Counter(
+    'vllm_response_cache_hits_total',
+    'Completions served from the response cache',
+    ['source', 'model_version']
 )
 
+CACHE_MISSES = Counter(
+    'vllm_response_cache_misses_total',
+    'Cacheable completions that had to run inference',
+    ['model_version']
+).labels(MODEL_VERSION)
+
 # ======================================
-# 2. 启动独立的 metrics server（端口 8001）
+# 2. 指标中间件：所有路由统一计时（含异常路径），/metrics 与业务接口同端口
 # ======================================
 
-def run_metrics_server():
-    start_http_server(8001)  # ← 自动提供 /metrics 接口
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件（不经过 BaseHTTPMiddleware，流式响应不会被缓冲）
+    route 取匹配到的路由模板而不是原始 path，未匹配的请求归为 unmatched，避免标签基数爆炸
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500  # 处理函数抛出未捕获异常时按 500 记录
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            # 流式响应在最后一块发送完才返回，记录的是完整的响应时间
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route else "unmatched", str(status), MODEL_VERSION)
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - start)
+            REQUESTS_TOTAL.labels(*labels).inc()
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
 
-# 在后台启动 metrics server
-threading.Thread(target=run_metrics_server, daemon=True).start()
 
 # ======================================
 # 3. 业务接口（vLLM 模拟推理）
 # ======================================
 
+async def generate_tokens(prompt: str, start_time: float):
+    """
+    模拟 vLLM 逐 token 生成：先 prefill，再按 TOKEN_INTERVAL 吐出 token
+    流式和非流式请求都走这里，TTFT / token 间隔 / 吞吐的记录方式一致
+    真实场景换成推理引擎的异步生成器（如 AsyncLLMEngine.generate）
+    """
+    tokens = re.findall(r'\S+\s*', f"Generated response for: {prompt}")
+    gen_start = time.perf_counter()
+    await asyncio.sleep(random.uniform(0.1, 0.3))  # 模拟 prefill；await 让出事件循环
+    last = time.perf_counter()
+    TIME_TO_FIRST_TOKEN.observe(time.time() - start_time)
+    yield tokens[0]
+    for token in tokens[1:]:
+        await asyncio.sleep(TOKEN_INTERVAL)
+        now = time.perf_counter()
+        INTER_TOKEN_LATENCY.observe(now - last)
+        TOKEN_LATENCY.observe(now - last)
+        last = now
+        yield token
+    TOKENS_PER_SECOND.observe(len(tokens) / (last - gen_start))
+
+
+async def stream_tokens(prompt: str, start_time: float):
+    """server-sent events：每个 token 一个 data 事件，以 data: [DONE] 结束；并发名额由 SlotStreamingResponse 释放"""
+    count = 0
+    async for token in generate_tokens(prompt, start_time):
+        count += 1
+        yield f"data: {json.dumps({'text': token, 'index': count - 1}, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
 @app.post("/v1/completions")
 async def completions(request: Request):
-    # 开始计时
+    # 开始计时（请求级指标由中间件记录，这里只用于 TTFT 和返回的 latency 字段）
     start_time = time.time()
 
     try:
-        # 模拟 vLLM 推理（真实场景调用 model.generate()）
         prompt_data = await request.json()
-        prompt = prompt_data.get("prompt", "hello")
-
-        # 模拟推理耗时（比如 0.3~0.8 秒）
-        import random
-        delay = random.uniform(0.3, 0.8)
-        time.sleep(delay)
-
-        # 模拟生成 token 数
-        tokens = len(prompt.split()) * 2
-        token_latency = delay / max(tokens, 1)
-        
-        # 记录指标（这才是关键！）
-        REQUEST_LATENCY.observe(time.time() - start_time)
-        REQUESTS_TOTAL.labels(method='POST', endpoint='/v1/completions', status='200').inc()
-        TOKEN_LATENCY.observe(token_latency)
-        GPU_UTIL.observe(random.uniform(0.4, 0.8))  # 模拟 GPU 使用率
-
-        return {
-            "text": f"Generated response for: {prompt}",
-            "tokens": tokens,
-            "latency": delay
-        }
-
-    except Exception as e:
-        # 记录错误
-        REQUESTS_TOTAL.labels(method='POST', endpoint='/v1/completions', status='500').inc()
-        return {"error": str(e)}, 500
-
-#也可以不写
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be JSON")
+    if not isinstance(prompt_data, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+    prompt = prompt_data.get("prompt", "hello")
+    if not isinstance(prompt, str):
+        raise HTTPException(status_code=400, detail="prompt must be a string")
+
+    if prompt_data.get("stream"):
+        await limiter.acquire()  # 名额不足时在开始推流前就返回 429/503
+        return SlotStreamingResponse(stream_tokens(prompt, start_time), limiter)
+
+    # 换成真实的阻塞推理时用 await asyncio.get_running_loop().run_in_executor(None, generate, ...)
+    async def generate():
+        async with limiter.slot():
+            return [token async for token in generate_tokens(prompt, start_time)]
+
+    if CACHE_SIZE and (prompt_data.get("temperature", 1.0) == 0 or prompt_data.get("cache")):
+        params = {k: prompt_data[k] for k in SAMPLING_PARAMS if k in prompt_data}
+        tokens, source = await response_cache.get_or_compute(response_cache.make_key(prompt, **params), generate)
+        if source == "miss":
+            CACHE_MISSES.inc()
+        else:
+            CACHE_HITS.labels(source, MODEL_VERSION).inc()
+    else:
+        tokens = await generate()
+
+    return {
+        "text": "".join(tokens),
+        "tokens": len(tokens),
+        "latency": time.time() - start_time,
+        "model_version": MODEL_VERSION,
+    }
+
+
 @app.get("/metrics")
 def metrics():
-    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
\ No newline at end of file
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
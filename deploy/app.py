@@ -1,12 +1,26 @@
 # app.py
 from fastapi import FastAPI
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
+import asyncio
+import json
+import os
 import random
+import re
 import time
 
+from serving import (
+    CACHE_SIZE, CACHE_TTL, MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT, ConcurrencyLimiter, ResponseCache,
+    SlotStreamingResponse,
+)
+
 app = FastAPI(title="Mock vLLM API (OpenAI Compatible)", version="0.1.0")
 
+TOKEN_INTERVAL = float(os.getenv("TOKEN_INTERVAL", "0.02"))  # 流式模式下模拟的每 token 生成间隔（秒）
+
+limiter = ConcurrencyLimiter(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT)
+response_cache = ResponseCache(CACHE_SIZE, CACHE_TTL)
+
 # 模拟一些“生成”的文本
 RESPONSE_SAMPLES = [
     "The capital of France is Paris.",
@@ -19,11 +33,14 @@ class CompletionRequest(BaseModel):
     prompt: str
     max_tokens: Optional[int] = 16
     temperature: Optional[float] = 0.7
-    n: Optional[int] = 1
+    n: int = Field(1, ge=1)
+    stream: Optional[bool] = False
+    cache: Optional[bool] = False  # temperature > 0 时显式允许复用缓存结果
 
 class Choice(BaseModel):
     text: str
     index: int
+    finish_reason: Optional[str] = None
 
 class CompletionResponse(BaseModel):
     id: str
@@ -32,17 +49,61 @@ class CompletionResponse(BaseModel):
     model: str
     choices: List[Choice]
 
+def split_tokens(text: str) -> List[str]:
+    """模拟分词：按单词切分，保留后面的空白，拼回去与原文一致"""
+    return re.findall(r'\S+\s*', text) or [text]
+
+
+async def stream_completion(request: CompletionRequest, texts: List[str]):
+    """
+    以 server-sent events 逐 token 推送（OpenAI 流式格式），最后发送 data: [DONE]
+    并发名额由 SlotStreamingResponse 持有和释放
+    """
+    completion_id = f"cmpl-{int(time.time())}"
+    created = int(time.time())
+    tokens = [split_tokens(text) for text in texts]
+    # 模拟 prefill：首个 token 之前的等待
+    await asyncio.sleep(random.uniform(0.05, 0.3))
+    for step in range(max(len(t) for t in tokens)):
+        if step:
+            await asyncio.sleep(TOKEN_INTERVAL)
+        choices = [
+            Choice(text=t[step], index=i, finish_reason="stop" if step == len(t) - 1 else None).model_dump()
+            for i, t in enumerate(tokens) if step < len(t)
+        ]
+        chunk = {"id": completion_id, "object": "text_completion", "created": created,
+                 "model": "mock-llama-3-8b", "choices": choices}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
 @app.post("/v1/completions", response_model=CompletionResponse)
 async def create_completion(request: CompletionRequest):
-    # 模拟延迟（0.1~1秒），相当于推理耗时
-    delay = random.uniform(0.1, 1.0)
-    time.sleep(delay)
+    if request.stream:
+        texts = [random.choice(RESPONSE_SAMPLES)[:request.max_tokens] for _ in range(request.n)]
+        await limiter.acquire()  # 名额不足时在开始推流前就返回 429/503
+        return SlotStreamingResponse(stream_completion(request, texts), limiter)
 
-    # 随机选择响应（可扩展为基于 prompt 的规则）
-    texts = [
-        random.choice(RESPONSE_SAMPLES)[:request.max_tokens]
-        for _ in range(request.n)
-    ]
+    async def generate():
+        async with limiter.slot():
+            # 模拟延迟（0.1~1秒），相当于推理耗时；await 让出事件循环，其他请求可以同时处理
+            # 换成真实的阻塞推理时用 await asyncio.get_running_loop().run_in_executor(None, generate, ...)
+            delay = random.uniform(0.1, 1.0)
+            await asyncio.sleep(delay)
+
+        # 随机选择响应（可扩展为基于 prompt 的规则）
+        return [
+            random.choice(RESPONSE_SAMPLES)[:request.max_tokens]
+            for _ in range(request.n)
+        ]
+
+    if CACHE_SIZE and (request.temperature == 0 or request.cache):
+        key = response_cache.make_key(
+            request.prompt, max_tokens=request.max_tokens, temperature=request.temperature, n=request.n
+        )
+        texts, _ = await response_cache.get_or_compute(key, generate)
+    else:
+        texts = await generate()
 
     return CompletionResponse(
         id=f"cmpl-{int(time.time())}",
@@ -50,13 +111,18 @@ async def create_completion(request: CompletionRequest):
         created=int(time.time()),
         model="mock-llama-3-8b",
         choices=[
-            Choice(text=text, index=i) for i, text in enumerate(texts)
+            Choice(text=text, index=i, finish_reason="stop") for i, text in enumerate(texts)
         ]
     )
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "in_flight": limiter.in_flight,
+        "waiting": limiter.waiting,
+        "cache": {"entries": len(response_cache), "hits": response_cache.hits, "misses": response_cache.misses},
+    }
 
 """
 构建镜像
@@ -78,6 +144,16 @@ curl -X POST http://localhost:8000/v1/completions \
            "temperature": 0.7
          }'
 
+相同 prompt 复用结果（temperature 为 0 时自动使用缓存，否则加 "cache": true；CACHE_SIZE / CACHE_TTL 环境变量调整）
+curl -X POST http://localhost:8000/v1/completions \
+     -H "Content-Type: application/json" \
+     -d '{"prompt": "When is the holiday?", "temperature": 0}'
+
+流式输出（server-sent events，逐 token 推送，最后一条是 data: [DONE]）
+curl -N -X POST http://localhost:8000/v1/completions \
+     -H "Content-Type: application/json" \
+     -d '{"prompt": "Hello", "max_tokens": 50, "stream": true}'
+
 给镜像打版本标签
 docker tag mock-vllm:latest your-registry/mock-vllm:v0.1-mock
 docker push your-registry/mock-vllm:v0.1-mock
@@ -0,0 +1,135 @@
+# serving.py
+"""
+两个推理服务（app.py 与 AB+monitor/app.py）共用的并发控制和响应缓存
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import json
+import os
+import time
+import unicodedata
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# 并发控制：同时推理的请求数上限，超出的请求排队；排队太多直接 429，等太久 503
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "32"))
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "64"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "5"))  # 秒
+
+# 响应缓存：相同 prompt + 采样参数直接返回上次结果；只在 temperature == 0 或请求带 "cache": true 时使用
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "1024"))  # 最多缓存多少条响应，0 为关闭
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))  # 秒
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        self._sem = asyncio.Semaphore(limit)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.waiting = 0
+        self.in_flight = 0
+
+    async def acquire(self):
+        if not self._sem.locked():
+            await self._sem.acquire()  # 有空位，立即拿到，不经过排队
+        else:
+            if self.waiting >= self.max_queue:
+                raise HTTPException(status_code=429, detail="Too many queued requests", headers={"Retry-After": "1"})
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._sem.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=503, detail="Server saturated", headers={"Retry-After": "1"})
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    占着一个并发名额的 server-sent events 响应：名额在 handler 里拿到（推流前就能返回 429/503），
+    在 __call__ 结束时释放。生成器的 finally 在客户端首块前断开、send 失败时不一定执行，这里每条路径都只释放一次
+    """
+
+    def __init__(self, content, limiter: ConcurrencyLimiter, **kwargs):
+        kwargs.setdefault("media_type", "text/event-stream")
+        kwargs.setdefault("headers", {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        super().__init__(content, **kwargs)
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+class ResponseCache:
+    """LRU + TTL；同一个 key 正在计算时，后来的请求等同一个结果（single-flight），不重复推理"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (过期时间, 结果)
+        self._inflight = {}  # key -> 正在计算的 Task
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(prompt: str, **params) -> str:
+        # 归一化：Unicode NFKC + 合并空白，"hello  world " 和 "hello world" 命中同一条
+        normalized = " ".join(unicodedata.normalize("NFKC", prompt).split())
+        raw = json.dumps([normalized, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get_or_compute(self, key: str, compute):
+        """返回 (结果, 来源)，来源为 hit / coalesced / miss；计算出错的结果不缓存"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], "hit"
+            del self._entries[key]
+        if key in self._inflight:
+            self.hits += 1
+            return await asyncio.shield(self._inflight[key]), "coalesced"
+        self.misses += 1
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._store(key, t))
+        # shield：发起请求的客户端断开时，共享的计算不会被取消，其他等待者照常拿到结果
+        return await asyncio.shield(task), "miss"
+
+    def _store(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)